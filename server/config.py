@@ -0,0 +1,89 @@
+import json
+import os
+
+# 用户存储根目录
+CLOUD_ROOT = os.environ.get("VF_CLOUD_ROOT", "./cloud")
+
+# 用户目录分片: {root}/{hash[0:2]}/{hash[2:4]}/{username}, root 按哈希从 STORAGE_ROOTS 中选择
+# STORAGE_ROOTS 可以是多个挂载点, 逗号分隔; SHARD_DEPTH 为 0 时与旧的 {CLOUD_ROOT}/{username} 相同
+STORAGE_ROOTS = [root for root in os.environ.get("VF_STORAGE_ROOTS", CLOUD_ROOT).split(",") if root]
+SHARD_DEPTH = int(os.environ.get("VF_SHARD_DEPTH", "2"))
+SHARD_WIDTH = int(os.environ.get("VF_SHARD_WIDTH", "2"))  # 每级目录名的十六进制字符数
+
+# 变更通知
+EVENTS_QUEUE_SIZE = int(os.environ.get("VF_EVENTS_QUEUE_SIZE", "1000"))  # 单个订阅者最多缓存的事件数, 超出后要求客户端重新加载
+EVENTS_COALESCE_SECONDS = float(os.environ.get("VF_EVENTS_COALESCE_SECONDS", "0.2"))  # 合并窗口
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get("VF_EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_WATCH = os.environ.get("VF_EVENTS_WATCH", "1") == "1"  # 是否监听 CLOUD_ROOT 下的文件变化
+
+# 下载
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("VF_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# 适配器, 例如 {"resource": {"url": "ftp://host/{username}/resource", "cache": {"ttl": 10, "write_back": true}}}
+# 未配置 url 的适配器使用 CLOUD_ROOT 下的本地目录, 配置 cache 时在前面加一层 CacheFS
+ADAPTERS = json.loads(os.environ.get("VF_ADAPTERS", "{}"))
+
+# 只允许写入一次的适配器, 例如 "release": 文件发布后不能覆盖、移动或删除, 列表从预先生成的清单读取
+# 下载带内容哈希 ETag 和 Cache-Control: immutable
+IMMUTABLE_ADAPTERS = [key for key in os.environ.get("VF_IMMUTABLE_ADAPTERS", "").split(",") if key]
+IMMUTABLE_MAX_AGE = int(os.environ.get("VF_IMMUTABLE_MAX_AGE", str(365 * 24 * 3600)))
+CACHE_ROOT = os.environ.get("VF_CACHE_ROOT", "./cache")
+
+# 准入控制: 按开销给接口分类, 限制全局和单用户并发, 排队超出上限时返回 429
+# limit/per_user: 全局/单用户并发数, queue/user_queue: 全局/单用户最大排队数, max_wait: 最长排队秒数
+ADMISSION_CLASSES = json.loads(os.environ.get("VF_ADMISSION_CLASSES", "null")) or {
+    "light": {
+        "endpoints": ["index", "subfolders", "search", "preview", "trash", "sign"],
+        "limit": 64, "per_user": 16, "queue": 512, "user_queue": 64, "max_wait": 10,
+    },
+    "io": {
+        "endpoints": ["download", "upload", "save", "newfolder", "newfile", "rename", "move", "delete", "restore", "purge", "view"],
+        "limit": 16, "per_user": 4, "queue": 256, "user_queue": 32, "max_wait": 30,
+    },
+    "heavy": {
+        "endpoints": ["download_archive", "archive", "unarchive"],
+        "limit": 2, "per_user": 1, "queue": 32, "user_queue": 2, "max_wait": 60, "retry_after": 10,
+    },
+}
+
+# 可以访问 /admin 接口的用户
+ADMIN_USERS = [user for user in os.environ.get("VF_ADMIN_USERS", "").split(",") if user]
+
+# 请求追踪与性能采样
+TRACE_SLOW_SECONDS = float(os.environ.get("VF_TRACE_SLOW_SECONDS", "1.0"))  # 超过该耗时的请求写入慢请求日志
+PROFILE_SAMPLE_RATE = float(os.environ.get("VF_PROFILE_SAMPLE_RATE", "0"))  # 按比例随机采样, 0 表示关闭
+PROFILE_HEADER = os.environ.get("VF_PROFILE_HEADER", "")  # 例如 X-Profile, 管理员的请求带该头时采样, 为空表示关闭
+PROFILE_KEEP = int(os.environ.get("VF_PROFILE_KEEP", "20"))  # 保留最慢的 N 个采样结果
+PROFILE_INTERVAL = float(os.environ.get("VF_PROFILE_INTERVAL", "0.005"))  # 调用栈采样间隔
+
+# 回收站
+TRASH_RETENTION_SECONDS = float(os.environ.get("VF_TRASH_RETENTION_SECONDS", str(30 * 24 * 3600)))  # 删除后保留时长
+TRASH_PURGE_RATE = float(os.environ.get("VF_TRASH_PURGE_RATE", "500"))  # 后台清理每秒最多删除的文件数
+TRASH_PURGE_BATCH = int(os.environ.get("VF_TRASH_PURGE_BATCH", "100"))
+TRASH_PURGE_INTERVAL = float(os.environ.get("VF_TRASH_PURGE_INTERVAL", "300"))  # 扫描过期条目的间隔
+
+# 移动: 跨设备或跨适配器时并行复制的线程数, 复制后的校验方式 (size 或 hash)
+MOVE_WORKERS = int(os.environ.get("VF_MOVE_WORKERS", "8"))
+MOVE_VERIFY = os.environ.get("VF_MOVE_VERIFY", "size")
+
+# 下载授权: 签名链接有效期, 是否允许未登录访问 preview/download (旧行为)
+SIGNED_URL_EXPIRE_SECONDS = int(os.environ.get("VF_SIGNED_URL_EXPIRE_SECONDS", "3600"))
+PUBLIC_DOWNLOADS = os.environ.get("VF_PUBLIC_DOWNLOADS", "0") == "1"
+
+# 大文本按行查看: 稀疏索引的块大小, 单次最多返回的行数和单行字节数, 缓存的索引个数
+VIEW_BLOCK_SIZE = int(os.environ.get("VF_VIEW_BLOCK_SIZE", str(1024 * 1024)))
+VIEW_MAX_LINES = int(os.environ.get("VF_VIEW_MAX_LINES", "1000"))
+VIEW_MAX_LINE_BYTES = int(os.environ.get("VF_VIEW_MAX_LINE_BYTES", str(64 * 1024)))
+VIEW_CACHE_ENTRIES = int(os.environ.get("VF_VIEW_CACHE_ENTRIES", "64"))
+
+# 交给前端代理发送文件: "" 不启用, "x-accel-redirect" (nginx) 或 "x-sendfile" (apache/lighttpd)
+# nginx 需要配置 internal location, 例如 location /protected/ { internal; alias /srv/vuefinder/cloud/; }
+# 配置了多个 STORAGE_ROOTS 时路径前面加上根目录序号, 例如 /protected/1/ab/cd/alice/..., 每个根目录各配一个 location
+OFFLOAD_MODE = os.environ.get("VF_OFFLOAD_MODE", "")
+OFFLOAD_PREFIX = os.environ.get("VF_OFFLOAD_PREFIX", "/protected")
+
+# 启动预热: 在接收请求前打开常用用户的适配器并加载 mime 表
+# WARMUP_USERS 为固定列表, 另外每个 worker 退出时把用过的用户写入 WARMUP_FILE, 下次启动时预热其中前 WARMUP_MAX_USERS 个
+WARMUP_USERS = [user for user in os.environ.get("VF_WARMUP_USERS", "").split(",") if user]
+WARMUP_FILE = os.environ.get("VF_WARMUP_FILE", "./cache/warm_users.json")
+WARMUP_MAX_USERS = int(os.environ.get("VF_WARMUP_MAX_USERS", "100"))
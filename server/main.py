@@ -1,12 +1,32 @@
+import asyncio
+import contextlib
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import create_tables
 from routers.auth import router as auth
 from routers.cloud import router as cloud
+from routers.admin import router as admin
+from utils.events import watch_cloud_root
+from utils.file_operations import iter_adapters
+from utils.trash import purge_forever
+from utils.warmup import warm_up, save_users
+from config import EVENTS_WATCH
 
-create_tables()
 
-app = FastAPI()
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 建表和预热放在启动阶段, 导入 main 本身没有副作用
+    create_tables()
+    tasks = [await warm_up(), asyncio.create_task(purge_forever(iter_adapters))]
+    if EVENTS_WATCH:
+        tasks.append(asyncio.create_task(watch_cloud_root()))
+    yield
+    for task in tasks:
+        task.cancel()
+    save_users()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +38,7 @@ app.add_middleware(
 
 app.include_router(auth, prefix="/auth", tags=["auth"])
 app.include_router(cloud, prefix="/cloud", tags=["cloud"])
+app.include_router(admin, prefix="/admin", tags=["admin"])
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import PlainTextResponse
+from utils.auth import oauth2_scheme, get_current_user
+from utils.admission import admission
+from utils.tracing import profiles
+from config import ADMIN_USERS
+
+router = APIRouter()
+
+
+async def require_admin(request: Request):
+    token = await oauth2_scheme(request)
+    user = await get_current_user(request)
+    if user not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return user
+
+
+@router.get("/admission")
+async def admission_stats(request: Request):
+    # 各类接口的并发数与排队深度
+    await require_admin(request)
+    return admission.stats()
+
+
+@router.get("/profiles")
+async def profile_list(request: Request):
+    # 最慢的已采样请求
+    await require_admin(request)
+    return profiles.list()
+
+
+@router.get("/profiles/{id}")
+async def profile_detail(request: Request, id: int):
+    # 折叠格式的调用栈, 可直接交给 flamegraph.pl / speedscope
+    await require_admin(request)
+    trace = profiles.get(id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(trace.sampler.collapsed())
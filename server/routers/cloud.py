@@ -1,8 +1,15 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from utils.file_operations import RequestContext, endpoints
 from fs import errors
-from utils.auth import oauth2_scheme, get_current_user
+from utils.auth import require_user, get_current_user
+from utils.events import change_feed
+from utils.admission import admission
+from utils.tracing import trace_request, span, profile_requested, start_profiling
+from utils.signing import authorize_download
+from utils.warmup import record_user
+from utils.layout import UserMigrating
+from config import ADMIN_USERS
 
 router = APIRouter()
 
@@ -16,21 +23,59 @@ async def dispatch_request(request: Request, username: str):
         return JSONResponse(headers=headers)
 
     q = request.query_params.get("q")
-    if q not in ["preview", "download"]:
-        # 验证用户
-        token = await oauth2_scheme(request)
-        user = await get_current_user(request)
-
-    if not q or q not in endpoints:
-        raise HTTPException(status_code=400, detail="Invalid endpoint")
-
-    try:
-        response = await endpoints[q](RequestContext(request, username))
-    except errors.ResourceReadOnly as exc:
-        return JSONResponse({"message": str(exc), "status": False}, status_code=400)
-    except HTTPException as exc:
-        return JSONResponse({"message": exc.detail, "status": False}, status_code=exc.status_code)
-    except Exception as exc:
-        return JSONResponse({"message": str(exc), "status": False}, status_code=500)    
-
-    return response 
\ No newline at end of file
+    cache_control = None
+    with trace_request(q, username) as trace:
+        with span("auth"):
+            if q in ["preview", "download"]:
+                # 签名链接或登录用户本人
+                cache_control = await authorize_download(request, username)
+            else:
+                # 其他接口 (包括生成签名链接的 sign) 只允许用户本人访问
+                await require_user(request, username)
+            record_user(username)
+            # 只有管理员可以用请求头触发采样
+            if profile_requested(request.headers) and await get_current_user(request) in ADMIN_USERS:
+                start_profiling(trace)
+
+        if not q or q not in endpoints:
+            raise HTTPException(status_code=400, detail="Invalid endpoint")
+
+        try:
+            async with admission.slot(q, username) as slot:
+                with span("handler"):
+                    response = await endpoints[q](RequestContext(request, username))
+                response = slot.hold_until_sent(response)
+        except (errors.ResourceReadOnly, errors.IllegalBackReference) as exc:
+            response = JSONResponse({"message": str(exc), "status": False}, status_code=400)
+        except HTTPException as exc:
+            response = JSONResponse({"message": exc.detail, "status": False}, status_code=exc.status_code, headers=exc.headers)
+        except UserMigrating:
+            response = JSONResponse({"message": "Storage is being migrated, retry later", "status": False}, status_code=503, headers={"Retry-After": "30"})
+        except Exception as exc:
+            response = JSONResponse({"message": str(exc), "status": False}, status_code=500)
+
+    response.headers["Server-Timing"] = trace.server_timing()
+    if cache_control is not None and response.status_code in (200, 304):
+        if "immutable" in response.headers.get("Cache-Control", ""):
+            if cache_control.startswith("public, max-age="):
+                # 签名链接: 共享缓存最多保存到签名过期, 不能延长链接的有效期
+                cache_control = f"{cache_control}, immutable"
+            else:
+                # 登录用户或公开下载: 只按授权方式区分 public/private, 有效期沿用响应自己的设置
+                scope = "private" if cache_control.startswith("private") else "public"
+                cache_control = f"{scope}, {response.headers['Cache-Control']}"
+        response.headers["Cache-Control"] = cache_control
+    return response
+
+
+@router.get("/{username}/events")
+async def events(request: Request, username: str):
+    # 变更通知 (Server-Sent Events)
+    await require_user(request, username)
+
+    subscriber = change_feed.subscribe(username)
+    return StreamingResponse(
+        change_feed.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,144 @@
+import io
+import os
+import sys
+import argparse
+import tempfile
+import time
+import zipfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fs.memoryfs import MemoryFS
+from fs.wrapfs import WrapFS
+from fs.zipfs import ZipFS
+from utils.cachefs import CacheFS
+
+
+class SlowFS(WrapFS):
+    # 每次调用都增加固定延迟, 模拟远程存储的往返时间
+    def __init__(self, wrap_fs, latency: float):
+        super().__init__(wrap_fs)
+        self.latency = latency
+        self.calls = 0
+
+    def _delay(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def getinfo(self, path, namespaces=None):
+        self._delay()
+        return super().getinfo(path, namespaces)
+
+    def scandir(self, path, namespaces=None, page=None):
+        self._delay()
+        return super().scandir(path, namespaces, page)
+
+    def openbin(self, path, mode="r", buffering=-1, **options):
+        self._delay()
+        file = super().openbin(path, mode, buffering, **options)
+        read = file.read
+
+        def slow_read(size=-1):
+            self._delay()
+            return read(size)
+
+        file.read = slow_read
+        return file
+
+
+def check(cache_dir: str, latency: float):
+    # 正确性检查, 块大小取得很小以便覆盖跨块读取
+    memory = MemoryFS()
+    data = os.urandom(10000)
+    memory.writebytes("/data.bin", data)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip:
+        for i in range(100):
+            zip.writestr(f"{i}.txt", os.urandom(50))
+    memory.writebytes("/archive.zip", archive.getvalue())
+
+    cached = CacheFS(SlowFS(memory, latency), cache_dir=cache_dir, block_size=1024, ttl=60)
+    with cached.openbin("/data.bin") as f:
+        assert f.read() == data, "full read"
+        f.seek(1000)
+        assert f.read(3000) == data[1000:4000], "read across blocks"
+        f.seek(9000)
+        assert f.read(5000) == data[9000:], "short read only at EOF"
+    with cached.openbin("/archive.zip") as f, ZipFS(f) as zip:
+        assert len(zip.listdir("/")) == 100, "zip directory spanning blocks"
+
+    # 通过缓存写入后, 内容、信息和所在目录的列表都不能是旧的
+    assert "new.bin" not in cached.listdir("/")
+    cached.writebytes("/data.bin", b"changed")
+    cached.writebytes("/new.bin", b"new")
+    assert cached.readbytes("/data.bin") == b"changed", "block invalidation after write"
+    assert cached.getsize("/data.bin") == 7, "info invalidation after write"
+    assert "new.bin" in cached.listdir("/"), "listing invalidation after write"
+    assert memory.readbytes("/data.bin") == b"changed"
+
+    # 回写: 写入后立即能读到, flush 之后远程才一定是新内容
+    remote = SlowFS(memory, latency)
+    write_back = CacheFS(remote, cache_dir=cache_dir, block_size=1024, ttl=60, write_back=True)
+    write_back.writebytes("/staged.bin", data)
+    with write_back.openbin("/staged.bin") as f:
+        assert f.read() == data, "read your writes before upload"
+    write_back.flush()
+    assert memory.readbytes("/staged.bin") == data, "flush uploads staged data"
+    assert write_back.readbytes("/staged.bin") == data, "read after flush"
+
+    # 所有实例共用一个块缓存和预算
+    assert write_back.block_cache is cached.block_cache, "shared block cache"
+    assert cached.block_cache.size <= cached.block_cache.max_bytes
+    print("checks passed")
+
+
+def timed(label: str, remote: SlowFS, func, repeat: int):
+    calls = remote.calls
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / repeat * 1000:8.1f} ms/op  {(remote.calls - calls) / repeat:6.1f} remote calls/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CacheFS against a latency-injected MemoryFS and compare timings with and without it")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check-only", action="store_true", help="only run the correctness checks")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        check(cache_dir, args.latency_ms / 1000)
+    if args.check_only:
+        return
+
+    memory = MemoryFS()
+    memory.makedir("/dir")
+    for i in range(args.files):
+        memory.writetext(f"/dir/{i}.txt", str(i))
+    memory.writebytes("/big.bin", os.urandom(args.size_mb * 1024 * 1024))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        remote = SlowFS(memory, args.latency_ms / 1000)
+        timed("direct scandir", remote, lambda: list(remote.scandir("/dir")), args.repeat)
+        timed("direct getinfo", remote, lambda: remote.getinfo("/dir/1.txt", ["details"]), args.repeat)
+        timed("direct sequential read", remote, lambda: _read(remote), args.repeat)
+
+        remote = SlowFS(memory, args.latency_ms / 1000)
+        cached = CacheFS(remote, cache_dir=cache_dir, ttl=60)
+        timed("cached scandir", remote, lambda: list(cached.scandir("/dir")), args.repeat)
+        timed("cached getinfo", remote, lambda: cached.getinfo("/dir/1.txt", ["details"]), args.repeat)
+        timed("cached sequential read", remote, lambda: _read(cached), args.repeat)
+
+
+def _read(fs):
+    with fs.openbin("/big.bin") as f:
+        while f.read(256 * 1024):
+            pass
+
+
+if __name__ == "__main__":
+    main()
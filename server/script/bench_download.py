@@ -0,0 +1,84 @@
+import os
+import sys
+import argparse
+import tempfile
+import threading
+import time
+import urllib.request
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WSGI_DIR = os.path.abspath(os.path.join(SERVER_DIR, "..", "wsgiserver"))
+sys.path.append(SERVER_DIR)
+
+
+def make_file(path: str, size: int):
+    # 稀疏文件, 读出来全是 0, 只测服务端的传输开销
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def fetch(url: str, chunk_size: int) -> tuple[int, float]:
+    total = 0
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+    return total, time.perf_counter() - start
+
+
+def serve_asgi(root: str, port: int):
+    os.environ["VF_CLOUD_ROOT"] = root
+    os.environ["VF_EVENTS_WATCH"] = "0"
+    import uvicorn
+    from main import app
+    from utils.signing import sign_url
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}" + sign_url("/cloud/bench", "bench", "download", "document", "document://big.bin")
+
+
+def serve_wsgi(root: str, port: int):
+    sys.path.insert(0, WSGI_DIR)
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+    from fs.osfs import OSFS
+    from app import VuefinderApp
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    app = VuefinderApp()
+    app.add_fs("document", OSFS(os.path.join(root, "bench", "document")))
+    server = make_server("127.0.0.1", port, app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}/?q=download&adapter=document&path=document://big.bin"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure download throughput on large files")
+    parser.add_argument("--size-gb", type=float, default=2.0)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8015)
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--wsgi", action="store_true", help="benchmark wsgiserver instead of the FastAPI server")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        make_file(os.path.join(root, "bench", "document", "big.bin"), int(args.size_gb * 1024 ** 3))
+        url = serve_wsgi(root, args.port) if args.wsgi else serve_asgi(root, args.port)
+
+        for run in range(args.runs):
+            total, elapsed = fetch(url, args.chunk_size)
+            print(f"run {run + 1}: {total / 1024 ** 2:.0f} MiB in {elapsed:.2f}s, {total / 1024 ** 2 / elapsed:.0f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import argparse
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fs.osfs import OSFS
+from fs.memoryfs import MemoryFS
+from utils import mover
+
+
+def make_tree(fs, root: str, files: int, per_dir: int = 1000):
+    for i in range(files):
+        dir_path = f"{root}/d{i // per_dir}"
+        if i % per_dir == 0:
+            fs.makedirs(dir_path, recreate=True)
+        fs.writebytes(f"{dir_path}/{i}.bin", b"x" * 128)
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the move engine with fs.movedir on trees of growing size")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="comma separated file counts")
+    args = parser.parse_args()
+
+    print(f"{'files':>8} {'movedir':>10} {'same-device':>12} {'cross-adapter':>14}")
+    for files in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as root:
+            document = OSFS(root).makedir("document")
+            release = OSFS(root).makedir("release")
+            make_tree(document, "/legacy", files)
+            make_tree(document, "/fast", files)
+
+            legacy = timed(lambda: document.movedir("/legacy", "/legacy-moved", create=True))
+            same_device = timed(lambda: mover.move(document, "/fast", release, "/fast"))
+
+            # 目标没有系统路径, 走并行复制 + 校验 + 删除
+            memory = MemoryFS()
+            cross = timed(lambda: mover.move(release, "/fast", memory, "/fast"))
+
+        print(f"{files:>8} {legacy:>9.3f}s {same_device:>11.4f}s {cross:>13.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import argparse
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(SERVER_DIR)
+
+
+def import_time(env: dict, cwd: str) -> float:
+    # 新进程中导入 main 的耗时, 不含解释器自身的启动
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=cwd, env=env)
+    return float(output)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request_time(env: dict, cwd: str, url: str, headers: dict, port: int, timeout: float = 30) -> float:
+    # 从启动 worker 进程到第一个请求成功返回的耗时
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                    response.read()
+                    return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"server did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request of the FastAPI server")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20, help="users in the warm-up list")
+    args = parser.parse_args()
+
+    # 在临时目录中运行, 数据库和用户目录都不落在仓库里
+    with tempfile.TemporaryDirectory() as root:
+        env = dict(
+            os.environ,
+            PYTHONPATH=SERVER_DIR,
+            VF_CLOUD_ROOT=os.path.join(root, "cloud"),
+            VF_CACHE_ROOT=os.path.join(root, "cache"),
+            VF_WARMUP_FILE=os.path.join(root, "warm_users.json"),
+            VF_WARMUP_USERS=",".join(f"user{i}" for i in range(args.users)),
+            VF_EVENTS_WATCH="0",
+        )
+        os.environ.update(env)
+        from utils.auth import create_access_token
+
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/cloud/user0?q=index&adapter=document&path=document://"
+        headers = {"Authorization": "Bearer " + create_access_token({"sub": "user0"})}
+
+        imports = [import_time(env, root) for _ in range(args.runs)]
+        firsts = [first_request_time(env, root, url, headers, port) for _ in range(args.runs)]
+
+    print(f"import main:        median {statistics.median(imports) * 1000:.0f} ms, min {min(imports) * 1000:.0f} ms")
+    print(f"first request:      median {statistics.median(firsts) * 1000:.0f} ms, min {min(firsts) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import sys
+sys.path.append("..")
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from passlib.context import CryptContext
+from models import User
+from database import engine, Base, SessionLocal
+from utils.file_operations import create_user_storage
+
+# 密码加密上下文
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+def read_users(path: str):
+    # 支持 CSV (带表头 username,password,email,full_name) 和 JSONL
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def insert_batch(db, rows: list[dict]) -> list[dict]:
+    # 整批插入一个事务, 出现冲突 (例如重复的 email) 时逐条插入并跳过失败的用户
+    try:
+        db.execute(insert(User), rows)
+        db.commit()
+        return rows
+    except IntegrityError:
+        db.rollback()
+
+    inserted = []
+    for row in rows:
+        try:
+            db.execute(insert(User), [row])
+            db.commit()
+            inserted.append(row)
+        except IntegrityError as exc:
+            db.rollback()
+            print(f"Skipping {row['username']}: {exc.orig}", file=sys.stderr)
+    return inserted
+
+def provision(path: str, batch_size: int, workers: int):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    users = read_users(path)
+    created = skipped = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(islice(users, batch_size))
+            if not batch:
+                break
+
+            # 已存在的用户直接跳过, 中断后重新运行即可从断点继续
+            batch = list({user["username"]: user for user in batch if user.get("username")}.values())
+            existing = set(db.scalars(select(User.username).where(User.username.in_([u["username"] for u in batch]))))
+            pending = [user for user in batch if user["username"] not in existing]
+            skipped += len(batch) - len(pending)
+
+            hashes = pool.map(get_password_hash, [user["password"] for user in pending], chunksize=max(1, len(pending) // (workers * 4)))
+            rows = [
+                {
+                    "username": user["username"],
+                    "hashed_password": hashed,
+                    "email": user.get("email") or None,
+                    "full_name": user.get("full_name") or None,
+                }
+                for user, hashed in zip(pending, hashes)
+            ]
+            inserted = insert_batch(db, rows)
+
+            # 已存在的用户也创建一遍 (幂等), 补上上次运行在插入之后、建目录之前中断的用户
+            for username in sorted(existing) + [row["username"] for row in inserted]:
+                create_user_storage(username)
+            created += len(inserted)
+
+            elapsed = time.perf_counter() - start
+            print(f"created {created}, skipped {skipped}, {created / elapsed:.1f} users/s")
+
+    db.close()
+    return created, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Create users in bulk from a CSV or JSONL file")
+    parser.add_argument("file")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    created, skipped = provision(args.file, args.batch_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"Done: {created} users created, {skipped} already existed, {elapsed:.1f}s ({created / max(elapsed, 1e-9):.1f} users/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import argparse
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fs.osfs import OSFS
+from fs.copy import copy_dir_if
+from utils.layout import iter_users, target_path, MIGRATING_SUFFIX, MIGRATED_SUFFIX
+from config import CLOUD_ROOT, STORAGE_ROOTS, SHARD_DEPTH
+
+
+def _same_device(src: str, dst_parent: str) -> bool:
+    return os.stat(src).st_dev == os.stat(dst_parent).st_dev
+
+
+def _tree(fs) -> dict[str, int | None]:
+    # 路径 -> 文件大小, 目录为 None
+    tree = {}
+    for path, info in fs.walk.info("/", namespaces=["details"]):
+        tree[path] = None if info.is_dir else info.size
+    return tree
+
+
+def _sync(src: str, staging: str, workers: int):
+    # 补上复制期间修改过的文件, 删除复制期间已被删除的文件
+    with OSFS(src) as src_fs, OSFS(staging) as dst_fs:
+        copy_dir_if(src_fs, "/", dst_fs, "/", condition="newer", workers=workers, preserve_time=True)
+        for path in sorted(set(_tree(dst_fs)) - set(_tree(src_fs)), reverse=True):
+            if dst_fs.isdir(path):
+                dst_fs.removetree(path)
+            elif dst_fs.exists(path):
+                dst_fs.remove(path)
+
+
+def migrate_user(src: str, dst: str, link: bool, workers: int) -> bool:
+    # 同设备时一次 rename; 跨设备时先在线复制, 再移开旧目录 (期间该用户的请求返回 503) 补齐修改后改名到位, 应在用户离线时进行
+    # 新旧目录的文件和大小一致才删除旧目录, 否则保留并返回 False; 旧位置留下符号链接供已打开的适配器使用
+    parent = os.path.dirname(dst)
+    os.makedirs(parent, exist_ok=True)
+    if _same_device(src, parent):
+        os.rename(src, dst)
+        if link:
+            os.symlink(os.path.abspath(dst), src)
+        return True
+
+    staging = dst + MIGRATING_SUFFIX
+    with OSFS(src) as src_fs, OSFS(staging, create=True) as dst_fs:
+        copy_dir_if(src_fs, "/", dst_fs, "/", condition="newer", workers=workers, preserve_time=True)
+    aside = src + MIGRATED_SUFFIX
+    os.rename(src, aside)
+    _sync(aside, staging, workers)
+    os.rename(staging, dst)
+    if link:
+        os.symlink(os.path.abspath(dst), src)
+
+    with OSFS(aside) as old_fs, OSFS(dst) as new_fs:
+        verified = _tree(old_fs) == _tree(new_fs)
+    if verified:
+        OSFS(aside).removetree("/")
+        os.rmdir(aside)
+    return verified
+
+
+def prune_links(roots: list[str]) -> int:
+    # 所有 worker 重启之后不再需要旧位置的符号链接
+    removed = 0
+    for root in roots:
+        for dir_path, dirs, files in os.walk(root):
+            depth = 0 if dir_path == root else len(os.path.relpath(dir_path, root).split(os.sep))
+            for name in dirs:
+                path = os.path.join(dir_path, name)
+                if os.path.islink(path):
+                    os.remove(path)
+                    removed += 1
+            if depth >= SHARD_DEPTH:
+                dirs.clear()
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move user directories to the layout configured by VF_STORAGE_ROOTS / VF_SHARD_DEPTH. "
+        "Moves across devices should be run while the users are offline."
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--no-link", action="store_true", help="do not leave a symlink at the old location")
+    parser.add_argument("--workers", type=int, default=8, help="copy threads for cross-device moves")
+    parser.add_argument("--prune-links", action="store_true", help="only remove symlinks left by an earlier migration")
+    args = parser.parse_args()
+
+    if args.prune_links:
+        print(f"removed {prune_links(list(dict.fromkeys([CLOUD_ROOT] + STORAGE_ROOTS)))} links")
+        return
+
+    moved = 0
+    kept = []
+    start = time.perf_counter()
+    for username, path in list(iter_users()):
+        dst = target_path(username)
+        if os.path.abspath(path) == os.path.abspath(dst):
+            continue
+        if os.path.exists(dst):
+            print(f"Skipping {username}: {dst} already exists", file=sys.stderr)
+            continue
+        print(f"{username}: {path} -> {dst}")
+        if not args.dry_run and not migrate_user(path, dst, not args.no_link, args.workers):
+            kept.append(path + MIGRATED_SUFFIX)
+        moved += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {moved} users moved in {elapsed:.1f}s")
+    for path in kept:
+        print(f"Kept {path}: it changed during the move, compare it with the new location", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
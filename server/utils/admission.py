@@ -0,0 +1,167 @@
+import asyncio
+import contextlib
+from collections import Counter, OrderedDict, deque
+from fastapi import HTTPException
+from starlette.responses import FileResponse, Response, StreamingResponse
+from utils.tracing import span
+from config import ADMISSION_CLASSES
+
+
+class FairLimiter(object):
+    # 全局与单用户并发上限, 排队的请求按用户轮询放行, 避免单个用户占满所有名额
+    def __init__(self, name: str, limit: int, per_user: int, queue: int, user_queue: int, max_wait: float, retry_after: int = 1):
+        self.name = name
+        self.limit = limit
+        self.per_user = per_user
+        self.queue = queue
+        self.user_queue = user_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.running = 0
+        self._user_running: Counter[str] = Counter()
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _reject(self):
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many {self.name} requests, retry later",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def _dispatch(self):
+        progress = True
+        while progress and self.running < self.limit:
+            progress = False
+            for user in list(self._waiters):
+                if self.running >= self.limit:
+                    break
+                if self._user_running[user] >= self.per_user:
+                    continue
+                waiters = self._waiters.pop(user)
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+                if not waiters:
+                    continue
+                waiters.popleft().set_result(None)
+                self.running += 1
+                self._user_running[user] += 1
+                progress = True
+                if waiters:
+                    # 放到队尾, 下一轮先轮到其他用户
+                    self._waiters[user] = waiters
+
+    async def acquire(self, user: str):
+        waiters = self._waiters.get(user, ())
+        if self.queued >= self.queue or len(waiters) >= self.user_queue:
+            self._reject()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append(future)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if future.done() and not future.cancelled():
+                self.release(user)
+            else:
+                future.cancel()
+                self._discard(user, future)
+            if isinstance(exc, asyncio.TimeoutError):
+                self._reject()
+            raise
+
+    def _discard(self, user: str, future: asyncio.Future):
+        waiters = self._waiters.get(user)
+        if waiters is None:
+            return
+        with contextlib.suppress(ValueError):
+            waiters.remove(future)
+        if not waiters:
+            del self._waiters[user]
+
+    def release(self, user: str):
+        self.running -= 1
+        self._user_running[user] -= 1
+        if self._user_running[user] <= 0:
+            del self._user_running[user]
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "per_user": self.per_user,
+            "running": self.running,
+            "queued": self.queued,
+            "users": {
+                user: {"running": self._user_running[user], "queued": len(self._waiters.get(user, ()))}
+                for user in set(self._user_running) | set(self._waiters)
+            },
+        }
+
+
+class _HeldResponse(Response):
+    # 包装流式响应, 响应体发送完或中途出错时都会释放名额
+    def __init__(self, response: Response, release):
+        self.response = response
+        self.release = release
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+        self.background = None
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+
+class Slot(object):
+    # 流式响应在 handler 返回之后才真正读取文件, 名额要保留到响应体发送完
+    def __init__(self, limiter: FairLimiter | None, user: str):
+        self.limiter = limiter
+        self.user = user
+        self.held = False
+
+    def hold_until_sent(self, response: Response) -> Response:
+        if self.limiter is None or not isinstance(response, (StreamingResponse, FileResponse)):
+            return response
+        self.held = True
+        return _HeldResponse(response, lambda: self.limiter.release(self.user))
+
+
+class AdmissionControl(object):
+    def __init__(self, classes: dict):
+        self.limiters: dict[str, FairLimiter] = {}
+        self._endpoints: dict[str, FairLimiter] = {}
+        for name, options in classes.items():
+            options = dict(options)
+            endpoints = options.pop("endpoints", [])
+            limiter = FairLimiter(name, **options)
+            self.limiters[name] = limiter
+            for endpoint in endpoints:
+                self._endpoints[endpoint] = limiter
+
+    @contextlib.asynccontextmanager
+    async def slot(self, endpoint: str, user: str):
+        limiter = self._endpoints.get(endpoint)
+        slot = Slot(limiter, user)
+        if limiter is None:
+            yield slot
+            return
+        with span("admission"):
+            await limiter.acquire(user)
+        try:
+            yield slot
+        finally:
+            if not slot.held:
+                limiter.release(user)
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+
+admission = AdmissionControl(ADMISSION_CLASSES)
@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from functools import lru_cache
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
@@ -11,11 +11,16 @@ SECRET_KEY = "b25d8db7d1114637349fa4eea9d49c86202ed3aa5e3cc8b93580ca6dcc47b985"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # passlib/bcrypt 只在登录时需要, 第一次使用时再加载
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_user(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
@@ -51,6 +56,21 @@ async def get_current_user(request: Request):
     return username
 
 
+# 要求登录用户为 username 本人, 未登录或令牌无效返回 401, 其他用户返回 403
+async def require_user(request: Request, username: str):
+    token = await oauth2_scheme(request)
+    user = await get_current_user(request)
+    if user == "public_user":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if user != username:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return user
+
+
 # async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
 #     credentials_exception = HTTPException(
 #         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,475 @@
+import hashlib
+import io
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from fs import errors
+from fs import path as fspath
+from fs.base import FS
+from fs.info import Info
+from fs.mode import Mode
+from config import CACHE_ROOT
+
+logger = logging.getLogger(__name__)
+
+
+class BlockCache(object):
+    # 本地磁盘块缓存, 按 LRU 淘汰, 总大小不超过 max_bytes
+    def __init__(self, cache_dir: str, max_bytes: int, block_size: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.size = 0
+        self._lru: OrderedDict[tuple[str, str, int], int] = OrderedDict()
+        self._keys: dict[str, set[tuple[str, str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def _filename(self, key: tuple[str, str, int]) -> str:
+        path, version, index = key
+        digest = hashlib.sha1(f"{path}\0{version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.{index}")
+
+    def get(self, path: str, version: str, index: int) -> bytes | None:
+        key = (path, version, index)
+        with self._lock:
+            if key not in self._lru:
+                return None
+            self._lru.move_to_end(key)
+        try:
+            with open(self._filename(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, path: str, version: str, index: int, data: bytes):
+        key = (path, version, index)
+        with open(self._filename(key), "wb") as f:
+            f.write(data)
+        with self._lock:
+            self.size += len(data) - self._lru.pop(key, 0)
+            self._lru[key] = len(data)
+            self._keys.setdefault(path, set()).add(key)
+            while self.size > self.max_bytes and self._lru:
+                self._discard(next(iter(self._lru)))
+
+    def invalidate(self, path: str):
+        with self._lock:
+            for key in list(self._keys.get(path, ())):
+                self._discard(key)
+
+    def invalidate_tree(self, prefix: str):
+        with self._lock:
+            for path in [path for path in self._keys if path.startswith(prefix)]:
+                for key in list(self._keys[path]):
+                    self._discard(key)
+
+    def _discard(self, key: tuple[str, str, int]):
+        self.size -= self._lru.pop(key, 0)
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+        try:
+            os.remove(self._filename(key))
+        except FileNotFoundError:
+            pass
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _blocks_dir(cache_dir: str) -> str:
+    # 每个 worker 进程一个块目录; 块的索引只在内存中, 已退出进程留下的目录直接删除
+    for name in os.listdir(cache_dir):
+        pid = name[len("blocks-"):]
+        if name.startswith("blocks-") and pid.isdigit() and (int(pid) == os.getpid() or not _alive(int(pid))):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    path = os.path.join(cache_dir, f"blocks-{os.getpid()}")
+    os.makedirs(path)
+    return path
+
+
+_block_caches: dict[tuple[str, int], BlockCache] = {}
+_block_caches_lock = threading.Lock()
+
+
+def shared_block_cache(cache_dir: str, max_bytes: int, block_size: int) -> BlockCache:
+    # 同一缓存目录和块大小的 CacheFS 共用一个块缓存和字节上限, 与打开的用户和适配器数量无关
+    key = (os.path.abspath(cache_dir), block_size)
+    with _block_caches_lock:
+        cache = _block_caches.get(key)
+        if cache is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            cache = _block_caches[key] = BlockCache(_blocks_dir(cache_dir), max_bytes, block_size)
+        cache.max_bytes = max(cache.max_bytes, max_bytes)
+        return cache
+
+
+class CachedFile(io.RawIOBase):
+    # 按块读取远程文件, 顺序读取时一次预取后续若干块
+    def __init__(self, fs: "CacheFS", path: str, info: Info):
+        super().__init__()
+        self.name = path
+        self.mode = "rb"
+        self._fs = fs
+        self._path = path
+        self._key = fs.block_key(path)
+        self._size = info.size
+        self._version = f"{info.modified.timestamp() if info.modified else ''}:{info.size}"
+        self._pos = 0
+        self._last_index = -2
+        self._remote = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def _block(self, index: int) -> bytes:
+        cache = self._fs.block_cache
+        data = cache.get(self._key, self._version, index)
+        if data is not None:
+            self._last_index = index
+            return data
+
+        count = 1 + (self._fs.prefetch if index == self._last_index + 1 else 0)
+        if self._remote is None:
+            self._remote = self._fs.remote_fs.openbin(self._path)
+        self._remote.seek(index * cache.block_size)
+        data = self._remote.read(cache.block_size * count)
+        for i in range(0, len(data), cache.block_size):
+            cache.put(self._key, self._version, index + i // cache.block_size, data[i:i + cache.block_size])
+        self._last_index = index
+        return data[:cache.block_size]
+
+    def readinto(self, buffer):
+        # 跨块读取时拼接多个块, 只有到达文件末尾才返回不足的字节数 (ZipFS、PIL 依赖完整读取)
+        view = memoryview(buffer).cast("B")
+        block_size = self._fs.block_cache.block_size
+        filled = 0
+        while filled < len(view) and self._pos < self._size:
+            index, offset = divmod(self._pos, block_size)
+            data = self._block(index)[offset:offset + len(view) - filled]
+            if not data:
+                break
+            view[filled:filled + len(data)] = data
+            filled += len(data)
+            self._pos += len(data)
+        return filled
+
+    def close(self):
+        if self._remote is not None:
+            self._remote.close()
+            self._remote = None
+        super().close()
+
+
+class _NotifyingFile(io.RawIOBase):
+    # 写入文件关闭时通知 CacheFS 失效缓存或提交回写
+    def __init__(self, file, path: str, mode: str, on_close):
+        super().__init__()
+        self.name = path
+        self.mode = mode
+        self._file = file
+        self._on_close = on_close
+
+    def readable(self):
+        return self._file.readable()
+
+    def writable(self):
+        return self._file.writable()
+
+    def seekable(self):
+        return self._file.seekable()
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def truncate(self, size=None):
+        return self._file.truncate(size)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._file.close()
+        self._on_close()
+
+
+class CacheFS(FS):
+    # 慢速存储前的本地缓存: 文件内容按块缓存在本地磁盘, 进程内共享, 超出 cache_bytes 后按 LRU 淘汰
+    # getinfo/scandir 结果缓存 ttl 秒; 写入直接写远端, write_back 时先暂存在本地再后台上传
+    def __init__(
+        self,
+        remote_fs: FS,
+        cache_dir: str = CACHE_ROOT,
+        cache_bytes: int = 1024 ** 3,
+        block_size: int = 1024 * 1024,
+        ttl: float = 5.0,
+        write_back: bool = False,
+        prefetch: int = 4,
+        namespace: str = None,
+    ):
+        super().__init__()
+        self.remote_fs = remote_fs
+        self.namespace = namespace or secrets.token_hex(8)
+        self.ttl = ttl
+        self.write_back = write_back
+        self.prefetch = prefetch
+        self.block_cache = shared_block_cache(cache_dir, cache_bytes, block_size)
+        # 回写的暂存文件不随进程清理, 上传失败时可以人工恢复
+        self._staging_dir = os.path.join(cache_dir, "staging")
+        os.makedirs(self._staging_dir, exist_ok=True)
+        self._infos: dict[tuple[str, frozenset], tuple[float, Info]] = {}
+        self._listings: dict[tuple[str, frozenset], tuple[float, list[Info]]] = {}
+        self._pending: dict[str, tuple[str, Future]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=2) if write_back else None
+
+    def __repr__(self):
+        return f"CacheFS({self.remote_fs!r})"
+
+    def getmeta(self, namespace="standard"):
+        return self.remote_fs.getmeta(namespace)
+
+    # 缓存管理
+
+    def block_key(self, path: str) -> str:
+        return f"{self.namespace}:{path}"
+
+    def _invalidate(self, path: str, tree: bool = False):
+        path = fspath.abspath(path)
+        prefix = fspath.forcedir(path)
+        parent = fspath.dirname(path)
+        with self._lock:
+            for cache in (self._infos, self._listings):
+                for key in list(cache):
+                    if key[0] == path or (tree and key[0].startswith(prefix)):
+                        del cache[key]
+            for key in list(self._listings):
+                if key[0] == parent:
+                    del self._listings[key]
+        self.block_cache.invalidate(self.block_key(path))
+        if tree:
+            self.block_cache.invalidate_tree(self.block_key(prefix))
+
+    def _settle(self, path: str):
+        # 等待该路径及其子路径上未完成的回写
+        path = fspath.abspath(path)
+        prefix = fspath.forcedir(path)
+        with self._lock:
+            futures = [
+                future for pending, (_, future) in self._pending.items()
+                if pending == path or pending.startswith(prefix)
+            ]
+        for future in futures:
+            future.result()
+
+    def flush(self):
+        self._settle("/")
+
+    def _cached(self, cache: dict, key: tuple):
+        with self._lock:
+            entry = cache.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    # 读取
+
+    def getinfo(self, path, namespaces=None):
+        path = fspath.abspath(self.validatepath(path))
+        key = (path, frozenset(namespaces or ()) | {"basic"})
+        info = self._cached(self._infos, key)
+        if info is not None:
+            return info
+        self._settle(path)
+        info = self.remote_fs.getinfo(path, namespaces)
+        with self._lock:
+            self._infos[key] = (time.monotonic() + self.ttl, info)
+        return info
+
+    def scandir(self, path, namespaces=None, page=None):
+        path = fspath.abspath(self.validatepath(path))
+        if page is not None:
+            self._settle(path)
+            return self.remote_fs.scandir(path, namespaces, page)
+
+        namespaces = frozenset(namespaces or ()) | {"basic"}
+        infos = self._cached(self._listings, (path, namespaces))
+        if infos is not None:
+            return iter(infos)
+        self._settle(path)
+        infos = list(self.remote_fs.scandir(path, list(namespaces)))
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._listings[(path, namespaces)] = (expires, infos)
+            for info in infos:
+                self._infos[(fspath.join(path, info.name), namespaces)] = (expires, info)
+        return iter(infos)
+
+    def listdir(self, path):
+        return [info.name for info in self.scandir(path)]
+
+    def openbin(self, path, mode="r", buffering=-1, **options):
+        _mode = Mode(mode)
+        _mode.validate_bin()
+        path = fspath.abspath(self.validatepath(path))
+
+        if _mode.writing:
+            return self._open_write(path, _mode, buffering, **options)
+
+        with self._lock:
+            # 回写尚未完成时直接读取暂存文件
+            if path in self._pending:
+                return open(self._pending[path][0], "rb")
+
+        info = self.getinfo(path, ["details"])
+        if info.is_dir:
+            raise errors.FileExpected(path)
+        return CachedFile(self, path, info)
+
+    # 写入
+
+    def _open_write(self, path: str, mode: Mode, buffering: int, **options):
+        self._settle(path)
+        self._invalidate(path)
+        # 独占创建 ("x") 不走回写, 直接由远端存储保证文件原本不存在
+        if not self.write_back or mode.exclusive:
+            return _NotifyingFile(
+                self.remote_fs.openbin(path, mode.to_platform_bin(), buffering, **options),
+                path,
+                mode.to_platform_bin(),
+                lambda: self._invalidate(path),
+            )
+
+        if not self.isdir(fspath.dirname(path)):
+            raise errors.ResourceNotFound(path)
+        exists = self.exists(path)
+        if exists and mode.exclusive:
+            raise errors.FileExists(path)
+        if not exists and not mode.create:
+            raise errors.ResourceNotFound(path)
+
+        fd, staging = tempfile.mkstemp(dir=self._staging_dir, suffix=".staging")
+        with os.fdopen(fd, "wb") as f:
+            if exists and not mode.truncate:
+                self.remote_fs.download(path, f)
+        file = open(staging, "r+b")
+        if mode.appending:
+            file.seek(0, io.SEEK_END)
+        return _NotifyingFile(file, path, mode.to_platform_bin(), lambda: self._submit(path, staging))
+
+    def _submit(self, path: str, staging: str):
+        def upload():
+            try:
+                with open(staging, "rb") as f:
+                    self.remote_fs.upload(path, f)
+            except Exception:
+                # 保留暂存文件以便人工恢复
+                logger.exception("write-back of %s failed, data kept in %s", path, staging)
+                raise
+            finally:
+                with self._lock:
+                    if self._pending.get(path, (None,))[0] == staging:
+                        del self._pending[path]
+                self._invalidate(path)
+            os.remove(staging)
+
+        self._invalidate(path)
+        with self._lock:
+            self._pending[path] = (staging, self._executor.submit(upload))
+
+    def makedir(self, path, permissions=None, recreate=False):
+        self._settle(path)
+        self.remote_fs.makedir(path, permissions, recreate)
+        self._invalidate(path)
+        return self.opendir(path)
+
+    def remove(self, path):
+        self._settle(path)
+        self.remote_fs.remove(path)
+        self._invalidate(path)
+
+    def removedir(self, path):
+        self._settle(path)
+        self.remote_fs.removedir(path)
+        self._invalidate(path, tree=True)
+
+    def removetree(self, dir_path):
+        self._settle(dir_path)
+        self.remote_fs.removetree(dir_path)
+        self._invalidate(dir_path, tree=True)
+
+    def setinfo(self, path, info):
+        self._settle(path)
+        self.remote_fs.setinfo(path, info)
+        self._invalidate(path)
+
+    def move(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        self._settle(src_path)
+        self._settle(dst_path)
+        self.remote_fs.move(src_path, dst_path, overwrite, preserve_time)
+        self._invalidate(src_path)
+        self._invalidate(dst_path)
+
+    def movedir(self, src_path, dst_path, create=False, preserve_time=False):
+        self._settle(src_path)
+        self._settle(dst_path)
+        self.remote_fs.movedir(src_path, dst_path, create, preserve_time)
+        self._invalidate(src_path, tree=True)
+        self._invalidate(dst_path, tree=True)
+
+    def copy(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        self._settle(src_path)
+        self._settle(dst_path)
+        self.remote_fs.copy(src_path, dst_path, overwrite, preserve_time)
+        self._invalidate(dst_path)
+
+    def close(self):
+        if not self.isclosed():
+            if self._executor is not None:
+                self.flush()
+                self._executor.shutdown()
+            self.remote_fs.close()
+            self.block_cache.invalidate_tree(self.block_key("/"))
+        super().close()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict, defaultdict
+from fs import path as fspath
+from utils.trash import is_trash_path
+from utils.layout import parse_syspath
+from config import CLOUD_ROOT, STORAGE_ROOTS, EVENTS_QUEUE_SIZE, EVENTS_COALESCE_SECONDS, EVENTS_KEEPALIVE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _merge(old: dict, new: dict) -> dict | None:
+    # 同一路径的事件合并, 返回 None 表示两者相互抵消
+    if old["type"] == "created" and new["type"] == "deleted":
+        return None
+    if old["type"] == "created" and new["type"] == "modified":
+        return old
+    if old["type"] == "deleted" and new["type"] == "created":
+        return dict(new, type="modified")
+    if old["type"] == "created" and new["type"] == "moved":
+        # 客户端还没见过原路径, 直接当作在新位置创建
+        return {"type": "created", "adapter": new["adapter"], "path": new["dest"]}
+    return new
+
+
+class Subscriber(object):
+    def __init__(self, username: str, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.username = username
+        self.maxsize = maxsize
+        self._pending: OrderedDict[tuple, dict] = OrderedDict()
+        self._overflow = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: dict):
+        # 不阻塞发布者: 按 (adapter, path) 合并, 超出上限时丢弃全部并通知客户端重新加载
+        if self._overflow:
+            return
+        key = (event["adapter"], event["path"])
+        if key in self._pending:
+            merged = _merge(self._pending.pop(key), event)
+            if merged is not None and merged["path"] != event["path"]:
+                # 路径变了, 按新路径重新合并
+                self.push(merged)
+                return
+            if merged is not None:
+                self._pending[key] = merged
+        elif len(self._pending) >= self.maxsize:
+            self._pending.clear()
+            self._overflow = True
+        else:
+            self._pending[key] = event
+        self._wakeup.set()
+
+    def drain(self) -> list[dict]:
+        if self._overflow:
+            events = [{"type": "resync"}]
+        else:
+            events = list(self._pending.values())
+        self._pending.clear()
+        self._overflow = False
+        self._wakeup.clear()
+        return events
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class ChangeFeed(object):
+    def __init__(self):
+        self._subscribers: dict[str, set[Subscriber]] = defaultdict(set)
+
+    def subscribe(self, username: str) -> Subscriber:
+        subscriber = Subscriber(username)
+        self._subscribers[username].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.username)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.username]
+
+    def has_subscribers(self, username: str) -> bool:
+        return username in self._subscribers
+
+    def publish(self, username: str, type: str, adapter: str, path: str, dest: str | None = None):
+        event = {"type": type, "adapter": adapter, "path": path}
+        if dest is not None:
+            event["dest"] = dest
+        for subscriber in self._subscribers.get(username, ()):
+            subscriber.push(event)
+
+    async def stream(self, subscriber: Subscriber):
+        # Server-Sent Events 格式输出, 空闲时发送注释行保持连接
+        try:
+            while True:
+                if not await subscriber.wait(EVENTS_KEEPALIVE_SECONDS):
+                    yield ": keepalive\n\n"
+                    continue
+                await asyncio.sleep(EVENTS_COALESCE_SECONDS)
+                for event in subscriber.drain():
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+change_feed = ChangeFeed()
+
+
+def to_vuefinder_path(adapter: str, path: str) -> str:
+    return f"{adapter}:/{fspath.abspath(path)}"
+
+
+async def watch_cloud_root(roots: list[str] = STORAGE_ROOTS + [CLOUD_ROOT]):
+    # 监听其他会话、脚本或后台任务对存储根目录的修改
+    try:
+        from watchfiles import awatch, Change
+    except ImportError:
+        logger.warning("watchfiles is not installed, filesystem change watching is disabled")
+        return
+
+    types = {Change.added: "created", Change.modified: "modified", Change.deleted: "deleted"}
+    roots = list(dict.fromkeys(os.path.abspath(root) for root in roots))
+    for root in roots:
+        os.makedirs(root, exist_ok=True)
+    async for changes in awatch(*roots, recursive=True):
+        for change, syspath in changes:
+            resolved = parse_syspath(syspath)
+            if resolved is None:
+                continue
+            username, adapter, path = resolved
+            if is_trash_path(path):
+                continue
+            if change_feed.has_subscribers(username):
+                change_feed.publish(username, types[change], adapter, to_vuefinder_path(adapter, path))
@@ -1,50 +1,114 @@
 from fastapi import Request, HTTPException, Body
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
 from starlette.datastructures import UploadFile
 from fs.osfs import OSFS
+from fs import open_fs
 from fs import path as fspath, errors, copy, walk
-from fs.zipfs import ZipFS
 from fs.base import FS
+import asyncio
 import io
+import os
 import mimetypes
 from typing import List, Dict
 from pathvalidate import is_valid_filename
 from utils.auth import get_current_user
 from utils.vuefinder import Adapter, to_vuefinder_resource
+from utils.events import change_feed, to_vuefinder_path
+from utils.streaming import SendfileResponse, get_syspath, iter_file, offload_response
+from utils.signing import sign_url
+from utils.cachefs import CacheFS
+from utils.immutable import ImmutableFS
+from utils.versions import directory_versions, version_token, token_counter
+from utils.tracing import span, to_thread
+from utils import trash as trash_bin
+from utils import mover
+from utils.lineview import read_lines
+from utils.layout import user_root, iter_users, UserMigrating
+from config import ADAPTERS, IMMUTABLE_ADAPTERS, IMMUTABLE_MAX_AGE
 from pydantic import BaseModel
 from urllib.parse import quote
-from PIL import Image
 
 # 全局字典存储用户适配器
 user_adapters = {}
+ADAPTER_KEYS = ["document", "resource", "release"]
+
+def _open_storage(username: str, key: str, create: bool = True) -> FS:
+    # 不带缓存和只写一次检查的底层存储
+    url = ADAPTERS.get(key, {}).get("url")
+    if url is None:
+        return OSFS(os.path.join(user_root(username), key), create=create)
+    return open_fs(url.format(username=username), create=create)
+
+def _open_adapter(username: str, key: str) -> FS:
+    options = ADAPTERS.get(key, {})
+    fs = _open_storage(username, key)
+
+    # 慢速存储前面加一层本地缓存
+    if "cache" in options:
+        fs = CacheFS(fs, namespace=f"{username}/{key}", **options["cache"])
+    if key in IMMUTABLE_ADAPTERS:
+        fs = ImmutableFS(fs)
+    return fs
 
 def get_user_adapters(username: str):
     if username not in user_adapters:
-        user_adapters[username] =  {
-            "document": OSFS(f"./cloud/{username}/document", create=True),
-            "resource": OSFS(f"./cloud/{username}/resource", create=True),
-            "release": OSFS(f"./cloud/{username}/release", create=True)
-        }
+        user_adapters[username] = {key: _open_adapter(username, key) for key in ADAPTER_KEYS}
     return user_adapters[username]
 
+def create_user_storage(username: str):
+    # 预先创建用户的存储目录, 不放入适配器缓存
+    for key in ADAPTER_KEYS:
+        _open_adapter(username, key).close()
+
+def iter_adapters():
+    # 所有用户的可删除适配器, 供回收站清理使用
+    # 正在使用的适配器直接复用, 其余临时打开底层存储, 用完即关, 不放入 user_adapters
+    usernames = set(user_adapters)
+    usernames.update(username for username, _ in iter_users())
+    for username in sorted(usernames):
+        for key in ADAPTER_KEYS:
+            if key in IMMUTABLE_ADAPTERS:
+                continue
+            if username in user_adapters:
+                yield user_adapters[username][key]
+                continue
+            try:
+                fs = _open_storage(username, key, create=False)
+            except (errors.CreateFailed, UserMigrating):
+                continue
+            try:
+                yield fs
+            finally:
+                fs.close()
+
+def _hide_trash(path: str, infos):
+    # 回收站目录不出现在列表中
+    if path != "/":
+        return infos
+    return (info for info in infos if "/" + info.name != trash_bin.TRASH_DIR)
+
 
 def _fs_path(path: str) -> str:
     if ":/" in path:
         return fspath.abspath(path.split(":/")[1])
     return fspath.abspath(path)
 
-def __move(fs, src, dst):
-    src = _fs_path(src)
-    dst = _fs_path(dst)
-    if fs.isdir(src):
-        fs.movedir(src, dst, create=True)
-    else:
-        fs.move(src, dst)
+def _adapter_key(path: str, default: str) -> str:
+    if ":/" in path:
+        return path.split(":/")[0]
+    return default
+
+async def __move(src_fs, src, dst_fs, dst):
+    # 同设备时是一次 rename, 否则并行复制校验后删除源文件, 放到线程中执行
+    await to_thread(mover.move, src_fs, _fs_path(src), dst_fs, _fs_path(dst))
 # Define RequestContext data class
 class RequestContext:
     def __init__(self, request, username):
         self.request = request
         self.username = username
+        self.changes = []
+        # 本次请求对各目录版本号的修改: (adapter, 目录) -> [(修改前, 修改后)]
+        self.bumps: Dict[tuple, List[tuple]] = {}
     
     async def get_storages(self) -> List[str]:
         user_adapters = get_user_adapters(self.username)
@@ -58,20 +122,69 @@ class RequestContext:
             return Adapter(key, value)
         return Adapter(key, user_adapters[key])
 
+    async def get_fs(self, key: str) -> FS:
+        user_adapters = get_user_adapters(self.username)
+        if key not in user_adapters:
+            raise HTTPException(status_code=400, detail=f"Invalid adapter {key}")
+        return user_adapters[key]
+
     async def get_full_path(self, adapter: Adapter) -> str:
         return self.request.query_params.get("path", adapter.key + "://")
     
     async def delegate(self) -> tuple[FS, str]:
-        adapter = await self.get_adapter()
-        full_path = await self.get_full_path(adapter)
-        fs, path = adapter.fs, _fs_path(full_path)
+        with span("delegate"):
+            adapter = await self.get_adapter()
+            full_path = await self.get_full_path(adapter)
+            fs, path = adapter.fs, _fs_path(full_path)
         return fs, path 
 
+    async def notify(self, type: str, path: str, dest: str = None, adapter_key: str = None):
+        # 记录本次请求的修改, 更新目录版本号并向该用户的变更订阅者推送事件
+        if adapter_key is None:
+            adapter_key = (await self.get_adapter()).key
+        path = _fs_path(path)
+        dest = _fs_path(dest) if dest is not None else None
+        self.changes.append((adapter_key, type, path, dest))
+        fs = await self.get_fs(adapter_key)
+        if isinstance(fs, ImmutableFS) and type in ("created", "modified"):
+            # 发布新内容时更新清单
+            await to_thread(fs.publish, path)
+        for changed in (path, dest):
+            if changed is not None:
+                dir_path = fspath.dirname(changed)
+                bump = directory_versions.bump(self.username, adapter_key, dir_path)
+                self.bumps.setdefault((adapter_key, dir_path), []).append(bump)
+        change_feed.publish(
+            self.username,
+            type,
+            adapter_key,
+            to_vuefinder_path(adapter_key, path),
+            to_vuefinder_path(adapter_key, dest) if dest is not None else None,
+        )
+
+    async def version(self) -> str:
+        adapter = await self.get_adapter()
+        fs, path = await self.delegate()
+        return version_token(fs, self.username, adapter.key, path)
+
+    async def changed_alone(self, base_version: str) -> bool:
+        # 从 base_version 到现在, 当前目录的版本号只因本次请求的修改而变化
+        adapter = await self.get_adapter()
+        fs, path = await self.delegate()
+        version = token_counter(base_version)
+        for previous, current in self.bumps.get((adapter.key, path), []):
+            if previous != version:
+                return False
+            version = current
+        return directory_versions.get(self.username, adapter.key, path) == version
+
 
 
 async def index(context: RequestContext, filter: str = None):
     fs, path = await context.delegate()
-    infos = list(fs.scandir(path, namespaces=["basic", "details"]))
+    with span("storage"):
+        version = await context.version()
+        infos = list(_hide_trash(path, fs.scandir(path, namespaces=["basic", "details"])))
 
     if filter:
         infos = [info for info in infos if filter in info.name]
@@ -79,14 +192,57 @@ async def index(context: RequestContext, filter: str = None):
     infos.sort(key=lambda i: ("0_" if i.is_dir else "1_") + i.name.lower())
 
     adapter = await context.get_adapter()
+    with span("serialize"):
+        return JSONResponse(
+            {
+                "adapter": adapter.key,
+                "storages": await context.get_storages(),
+                "dirname": await context.get_full_path(adapter),
+                "version": version,
+                "files": [
+                    to_vuefinder_resource(adapter.key, path, info) for info in infos
+                ],
+            }
+        )
+
+async def delta(context: RequestContext, base_version: str):
+    # 客户端请求 delta=1 且持有的版本号与修改前一致时, 只返回当前目录中增加、删除和修改的条目
+    # 期间有其他请求修改了同一目录时返回完整列表
+    params = context.request.query_params
+    if (
+        params.get("delta") not in ("1", "true")
+        or params.get("version") != base_version
+        or not await context.changed_alone(base_version)
+    ):
+        return await index(context)
+
+    fs, path = await context.delegate()
+    adapter = await context.get_adapter()
+    version = await context.version()
+    entries = {}
+    for key, type, src, dst in context.changes:
+        if key != adapter.key:
+            continue
+        if fspath.dirname(src) == path:
+            entries[src] = "removed" if type in ("deleted", "moved") else type
+        if dst is not None and fspath.dirname(dst) == path:
+            entries[dst] = "created"
+
+    added, removed, changed = [], [], []
+    for item_path, type in entries.items():
+        if type == "removed" or not fs.exists(item_path):
+            removed.append(to_vuefinder_path(adapter.key, item_path))
+            continue
+        resource = to_vuefinder_resource(adapter.key, path, fs.getinfo(item_path, ["basic", "details"]))
+        (added if type == "created" else changed).append(resource)
+
     return JSONResponse(
         {
             "adapter": adapter.key,
             "storages": await context.get_storages(),
             "dirname": await context.get_full_path(adapter),
-            "files": [
-                to_vuefinder_resource(adapter.key, path, info) for info in infos
-            ],
+            "version": version,
+            "delta": {"added": added, "removed": removed, "changed": changed},
         }
     )
 
@@ -97,11 +253,31 @@ async def download(context: RequestContext):
     headers = {
         "Content-Disposition": f'attachment; filename="{quote(info.name)}"',
     }
+
+    # 只写一次的文件内容不会变, 用内容哈希做 ETag 并允许长期缓存
+    digest = info.get("hash", "sha256")
+    if digest is not None:
+        headers["ETag"] = f'"{digest}"'
+        headers["Cache-Control"] = f"max-age={IMMUTABLE_MAX_AGE}, immutable"
+        if context.request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+
+    syspath = get_syspath(fs, path)
+    if syspath is not None:
+        offloaded = offload_response(syspath, headers, "application/octet-stream")
+        if offloaded is not None:
+            return offloaded
+        return SendfileResponse(
+            syspath,
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
     if info.size is not None:
         headers["Content-Length"] = str(info.size)
 
     return StreamingResponse(
-        fs.open(path, "rb"),
+        iter_file(fs, path),
         media_type="application/octet-stream",
         headers=headers,
     )
@@ -127,6 +303,9 @@ async def preview(context: RequestContext):
     #     headers=headers,
     # )
 
+    # PIL 只在生成缩略图时加载, 不拖慢启动
+    from PIL import Image
+
      # 打开图像并生成缩略图
     with fs.open(path, "rb") as file_like:
         image = Image.open(file_like)
@@ -147,9 +326,47 @@ async def preview(context: RequestContext):
     )
     
 
+async def view(context: RequestContext):
+    # 按行分段查看大文本文件: head, tail, line (从第 line 行开始), follow (offset 之后追加的内容)
+    # 返回文件内容, 与 download 一样只允许用户本人访问 (由 dispatch_request 检查)
+    fs, path = await context.delegate()
+    # getinfo 会校验路径, 不能用 .. 跳出用户目录; 之后才能取系统路径
+    if fs.getinfo(path).is_dir:
+        raise HTTPException(status_code=400, detail="Line view is only available for files")
+    syspath = get_syspath(fs, path)
+    if syspath is None:
+        raise HTTPException(status_code=400, detail="Line view is only available for local storage")
+
+    params = context.request.query_params
+    mode = params.get("mode", "head")
+    if mode not in ("head", "tail", "line", "follow"):
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    try:
+        line, count, offset = int(params.get("line", 1)), int(params.get("count", 100)), int(params.get("offset", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid line range")
+    if line < 1 or count < 1 or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid line range")
+
+    result = await to_thread(read_lines, syspath, mode, line, count, offset)
+    adapter = await context.get_adapter()
+    return JSONResponse({"adapter": adapter.key, "path": await context.get_full_path(adapter), **result})
+
+async def sign(context: RequestContext):
+    # 生成带签名的 preview/download 链接, 无需登录即可在有效期内访问
+    adapter = await context.get_adapter()
+    full_path = await context.get_full_path(adapter)
+    base = context.request.url.path
+    return JSONResponse(
+        {
+            "preview": sign_url(base, context.username, "preview", adapter.key, full_path),
+            "download": sign_url(base, context.username, "download", adapter.key, full_path),
+        }
+    )
+
 async def subfolders(context: RequestContext):
     fs, path = await context.delegate()
-    infos = fs.scandir(path, namespaces=["basic", "details"])
+    infos = _hide_trash(path, fs.scandir(path, namespaces=["basic", "details"]))
     adapter = await context.get_adapter()
     return JSONResponse(
         {
@@ -166,49 +383,104 @@ async def search(context: RequestContext):
     return await index(context, filter)
 
 async def newfolder(context: RequestContext):
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     name = data.get("name", "")
     
     fs.makedir(fspath.join(path, name))
-    return await index(context)
+    await context.notify("created", fspath.join(path, name))
+    return await delta(context, base_version)
 
 async def newfile(context: RequestContext):
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     name = data.get("name", "")
 
     fs.writetext(fspath.join(path, name), "")
-    return await index(context)
+    await context.notify("created", fspath.join(path, name))
+    return await delta(context, base_version)
 
 
 async def rename(context: RequestContext):
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     src = data.get("item", "")
     dst = fspath.join(path, data.get("name", ""))
-    __move(fs, src, dst)
-    return await index(context)
+    await __move(fs, src, fs, dst)
+    await context.notify("moved", src, dst)
+    return await delta(context, base_version)
 
 async def move(context: RequestContext):
-    fs, _ = await context.delegate()
+    base_version = await context.version()
+    adapter = await context.get_adapter()
     data = await context.request.json()
     dst_dir = data.get("item", "")
+    # 路径带有适配器前缀时可以在适配器之间移动, 例如 document:// -> release://
+    dst_key = _adapter_key(dst_dir, adapter.key)
+    dst_fs = await context.get_fs(dst_key)
     for item in data.get("items", []):
         src = item["path"]
-        __move(fs, src, fspath.combine(dst_dir, fspath.basename(src)))
-    return await index(context)
+        src_key = _adapter_key(src, adapter.key)
+        dst = fspath.combine(dst_dir, fspath.basename(src))
+        await __move(await context.get_fs(src_key), src, dst_fs, dst)
+        if src_key == dst_key:
+            await context.notify("moved", src, dst, adapter_key=src_key)
+        else:
+            await context.notify("deleted", src, adapter_key=src_key)
+            await context.notify("created", dst, adapter_key=dst_key)
+    return await delta(context, base_version)
 
 async def delete(context: RequestContext):
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     for item in data.get("items", []):
+        # 移入回收站, 由后台任务按保留期限清理
         item_path = _fs_path(item["path"])
-        if fs.isdir(item_path):
-            fs.removetree(item_path)
-        else:
-            fs.remove(item_path)
-    return await index(context)
+        await to_thread(trash_bin.move_to_trash, fs, item_path)
+        await context.notify("deleted", item_path)
+    return await delta(context, base_version)
+
+async def trash(context: RequestContext):
+    fs, _ = await context.delegate()
+    adapter = await context.get_adapter()
+    return JSONResponse(
+        {
+            "adapter": adapter.key,
+            "items": [
+                {
+                    "id": item["id"],
+                    "path": to_vuefinder_path(adapter.key, item["path"]),
+                    "basename": fspath.basename(item["path"]),
+                    "type": item["type"],
+                    "deleted": item["deleted"],
+                }
+                for item in await to_thread(trash_bin.list_trash, fs)
+            ],
+        }
+    )
+
+async def restore(context: RequestContext):
+    fs, _ = await context.delegate()
+    data = await context.request.json()
+    for item in data.get("items", []):
+        try:
+            path = await to_thread(trash_bin.restore, fs, item["id"])
+        except errors.DestinationExists as exc:
+            raise HTTPException(status_code=400, detail=f"{exc.path} already exists")
+        await context.notify("created", path)
+    return await trash(context)
+
+async def purge(context: RequestContext):
+    fs, _ = await context.delegate()
+    data = await context.request.json()
+    items = await to_thread(trash_bin.list_trash, fs) if data.get("all") else data.get("items", [])
+    for id in [item["id"] for item in items]:
+        await to_thread(trash_bin.mark_purge, fs, id)
+    return await trash(context)
 
 async def upload(context: RequestContext):
     fs, path = await context.delegate()
@@ -217,9 +489,11 @@ async def upload(context: RequestContext):
     for key, fsrc in form.items():
         if isinstance(fsrc, UploadFile):
             file_path = fspath.join(path, fsrc.filename)
+            exists = fs.exists(file_path)
             with fs.open(file_path, "wb") as fdst:
                 content = await fsrc.read()
                 fdst.write(content)
+            await context.notify("modified" if exists else "created", file_path)
 
     return JSONResponse("ok")
 
@@ -245,6 +519,8 @@ def _get_filename(payload: dict, param: str = "name", ext: str = "") -> str:
     return name
 
 async def archive(context: RequestContext):
+    from fs.zipfs import ZipFS
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     name = _get_filename(data, ext=".zip")
@@ -259,9 +535,11 @@ async def archive(context: RequestContext):
         with ZipFS(f, write=True) as zip:
             _write_zip(zip, fs, paths, path)
 
-    return await index(context)
+    await context.notify("created", archive_path)
+    return await delta(context, base_version)
 
 async def download_archive(context: RequestContext):
+    from fs.zipfs import ZipFS
     name = _get_filename(await context.request.json(), ext=".zip")  
     fs, path = await context.delegate()
     data = await context.request.json()
@@ -282,6 +560,8 @@ async def download_archive(context: RequestContext):
     )
 
 async def unarchive(context: RequestContext):
+    from fs.zipfs import ZipFS
+    base_version = await context.version()
     fs, path = await context.delegate()
     data = await context.request.json()
     archive_path = _fs_path(data.get("item", ""))
@@ -295,8 +575,11 @@ async def unarchive(context: RequestContext):
                     raise HTTPException(status_code=400, detail=f"File {dst_path} would be overridden by unarchive")
 
             copy.copy_dir(zip, "/", fs, path)
+            created = zip.listdir("/")
 
-    return await index(context)
+    for name in created:
+        await context.notify("created", fspath.join(path, name))
+    return await delta(context, base_version)
 
 async def save(context: RequestContext):
     fs, path = await context.delegate()
@@ -304,6 +587,7 @@ async def save(context: RequestContext):
     content = data.get("content", "")
     with fs.open(path, "w") as f:
         f.write(content)
+    await context.notify("modified", path)
     return await preview(context)
 
 # Define a mapping of endpoint names to functions
@@ -323,4 +607,9 @@ endpoints = {
     "archive": archive,
     "unarchive": unarchive,
     "save": save,
+    "trash": trash,
+    "restore": restore,
+    "purge": purge,
+    "sign": sign,
+    "view": view,
 }
\ No newline at end of file
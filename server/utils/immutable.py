@@ -0,0 +1,261 @@
+import contextlib
+import hashlib
+import json
+import logging
+import threading
+import time
+from fs import errors
+from fs import path as fspath
+from fs.base import FS
+from fs.info import Info
+from fs.mode import Mode
+from fs.wrapfs import WrapFS
+from utils.trash import TRASH_DIR, is_trash_path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = "/.manifest.json"
+# 多个 worker 之间的清单写锁, 持有者崩溃后超过 LOCK_STALE 秒视为失效
+LOCK_PATH = MANIFEST_PATH + ".lock"
+LOCK_STALE = 60
+
+
+def _digest(fs, path: str) -> str:
+    sha = hashlib.sha256()
+    with fs.openbin(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _exclusive(mode: str) -> str:
+    # 写入一律以 "x" 模式交给底层存储, 文件已存在时由操作系统拒绝, 不存在先检查后写入的竞争
+    _mode = Mode(mode)
+    return "x" + ("b" if _mode.binary else "") + ("+" if _mode.reading else "")
+
+
+def _via_open(name: str):
+    # 使用 FS 基类的实现, 写入都经过下面的 openbin / open
+    def method(self, path, *args, **kwargs):
+        return getattr(FS, name)(self, path, *args, **kwargs)
+    return method
+
+
+class ImmutableFS(WrapFS):
+    # 只写一次的适配器: 可以新建文件和目录, 已有的不能覆盖、移动或删除
+    # /.manifest.json 记录所有条目的列表、大小和 sha256, 列表和 getinfo 由它提供, 在后台线程中建立, 建好之前直接读底层存储
+
+    # mover 通过该属性识别, 避免走 os.rename 绕过检查
+    write_once = True
+
+    def __init__(self, wrap_fs):
+        super().__init__(wrap_fs)
+        self._entries: dict[str, dict] = None
+        self._children: dict[str, list[str]] = {}
+        self._stamp = None
+        self._manifest_lock = threading.RLock()
+        self._builder: threading.Thread = None
+        self._builder_lock = threading.Lock()
+
+    # 清单
+
+    def _manifest_stamp(self):
+        try:
+            raw = self.delegate_fs().getinfo(MANIFEST_PATH, ["details"]).raw["details"]
+        except errors.ResourceNotFound:
+            return None
+        return raw.get("modified"), raw.get("size")
+
+    def _entry(self, path: str) -> dict:
+        fs = self.delegate_fs()
+        raw = fs.getinfo(path, ["basic", "details"]).raw
+        if raw["basic"]["is_dir"]:
+            return raw
+        return dict(raw, hash={"sha256": _digest(fs, path)})
+
+    def _scan(self) -> dict[str, dict]:
+        fs = self.delegate_fs()
+        entries = {"/": self._entry("/")}
+        for dir_path, dirs, files in fs.walk.walk("/", exclude_dirs=[fspath.basename(TRASH_DIR)]):
+            for info in dirs + files:
+                path = fspath.join(dir_path, info.name)
+                if not path.startswith(MANIFEST_PATH):
+                    entries[path] = self._entry(path)
+        return entries
+
+    def _load(self, entries: dict[str, dict]):
+        children: dict[str, list[str]] = {}
+        for path in entries:
+            if path != "/":
+                children.setdefault(fspath.dirname(path), []).append(path)
+        self._entries, self._children = entries, children
+
+    def _save(self, entries: dict[str, dict]):
+        fs = self.delegate_fs()
+        fs.writetext(MANIFEST_PATH + ".tmp", json.dumps({"entries": entries}))
+        fs.move(MANIFEST_PATH + ".tmp", MANIFEST_PATH, overwrite=True)
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        # 清单的读-改-写要跨进程串行, 否则两个 worker 同时发布时会丢掉一个条目
+        fs = self.delegate_fs()
+        while True:
+            try:
+                with fs.openbin(LOCK_PATH, "x"):
+                    break
+            except errors.FileExists:
+                with contextlib.suppress(errors.ResourceNotFound):
+                    modified = fs.getinfo(LOCK_PATH, ["details"]).modified
+                    if modified is not None and time.time() - modified.timestamp() > LOCK_STALE:
+                        fs.remove(LOCK_PATH)
+                        continue
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            with contextlib.suppress(errors.ResourceNotFound):
+                fs.remove(LOCK_PATH)
+
+    def _read(self) -> dict[str, dict] | None:
+        try:
+            return json.loads(self.delegate_fs().readtext(MANIFEST_PATH))["entries"]
+        except errors.ResourceNotFound:
+            return None
+
+    def manifest(self) -> dict[str, dict]:
+        # 其他 worker 发布后清单文件会变化, 只需一次 stat 即可发现
+        with self._manifest_lock:
+            stamp = self._manifest_stamp()
+            if self._entries is None or stamp != self._stamp:
+                entries = self._read() if stamp is not None else None
+                if entries is None:
+                    with self._write_lock():
+                        # 等锁期间其他 worker 可能已经建好了清单
+                        entries = self._read()
+                        if entries is None:
+                            entries = self._scan()
+                            self._save(entries)
+                self._load(entries)
+                self._stamp = self._manifest_stamp()
+            return self._entries
+
+    def _build(self):
+        try:
+            self.manifest()
+        except Exception:
+            logger.exception("building the manifest failed")
+
+    def _ready_manifest(self) -> dict[str, dict] | None:
+        # 读取路径上只做一次 stat, 扫描整棵目录树的工作不能阻塞事件循环
+        entries = self._entries
+        if entries is not None and self._stamp is not None and self._manifest_stamp() == self._stamp:
+            return entries
+        with self._builder_lock:
+            if self._builder is None or not self._builder.is_alive():
+                self._builder = threading.Thread(target=self._build, daemon=True)
+                self._builder.start()
+        return None
+
+    def publish(self, path: str):
+        # 新写入的文件或目录加入清单, 同时更新上级目录的修改时间
+        path = fspath.abspath(path)
+        with self._manifest_lock, self._write_lock():
+            # 持锁后重新读取清单文件, 包含其他 worker 刚发布的条目
+            entries = self._read()
+            if entries is None:
+                entries = self._scan()
+            fs = self.delegate_fs()
+            entries[path] = self._entry(path)
+            if entries[path]["basic"]["is_dir"]:
+                for dir_path, dirs, files in fs.walk.walk(path):
+                    for info in dirs + files:
+                        child = fspath.join(dir_path, info.name)
+                        entries[child] = self._entry(child)
+            parent = path
+            while parent != "/":
+                parent = fspath.dirname(parent)
+                entries[parent] = self._entry(parent)
+            self._save(entries)
+            self._load(entries)
+            self._stamp = self._manifest_stamp()
+
+    # 读取
+
+    def getinfo(self, path, namespaces=None):
+        entry = (self._ready_manifest() or {}).get(fspath.abspath(path))
+        if entry is None:
+            return super().getinfo(path, namespaces)
+        return Info(entry)
+
+    def scandir(self, path, namespaces=None, page=None):
+        path = fspath.abspath(path)
+        entries = self._ready_manifest()
+        if entries is None:
+            infos = super().scandir(path, namespaces, page)
+            return (info for info in infos if not fspath.join(path, info.name).startswith(MANIFEST_PATH))
+        if path not in entries:
+            return super().scandir(path, namespaces, page)
+        if not entries[path]["basic"]["is_dir"]:
+            raise errors.DirectoryExpected(path)
+        children = self._children.get(path, [])
+        if page is not None:
+            children = children[page[0]:page[1]]
+        return iter([Info(entries[child]) for child in children])
+
+    def listdir(self, path):
+        return [info.name for info in self.scandir(path)]
+
+    # 写入检查
+
+    def _check_new(self, path: str):
+        if is_trash_path(fspath.abspath(path)):
+            raise errors.ResourceReadOnly(path, msg="Items in immutable storage cannot be deleted")
+        if self.delegate_fs().exists(path):
+            raise errors.ResourceReadOnly(path, msg=f"{path} is immutable and cannot be overwritten")
+
+    def _deny(self, path: str, *args, **kwargs):
+        raise errors.ResourceReadOnly(path, msg=f"{path} is immutable")
+
+    remove = removedir = removetree = setinfo = settimes = touch = move = movedir = _deny
+
+    def openbin(self, path, mode="r", *args, **kwargs):
+        if not Mode(mode).writing:
+            return super().openbin(path, mode, *args, **kwargs)
+        self._check_new(path)
+        try:
+            return super().openbin(path, _exclusive(mode), *args, **kwargs)
+        except errors.FileExists:
+            raise errors.ResourceReadOnly(path, msg=f"{path} is immutable and cannot be overwritten")
+
+    def open(self, path, mode="r", *args, **kwargs):
+        if not Mode(mode).writing:
+            return super().open(path, mode, *args, **kwargs)
+        self._check_new(path)
+        try:
+            return super().open(path, _exclusive(mode), *args, **kwargs)
+        except errors.FileExists:
+            raise errors.ResourceReadOnly(path, msg=f"{path} is immutable and cannot be overwritten")
+
+    def makedir(self, path, *args, **kwargs):
+        # 删除会先在回收站中建目录、写元数据
+        if is_trash_path(fspath.abspath(path)):
+            self._check_new(path)
+        return super().makedir(path, *args, **kwargs)
+
+    def makedirs(self, path, *args, **kwargs):
+        if is_trash_path(fspath.abspath(path)):
+            self._check_new(path)
+        return super().makedirs(path, *args, **kwargs)
+
+    create = _via_open("create")
+    writebytes = _via_open("writebytes")
+    writetext = _via_open("writetext")
+    upload = _via_open("upload")
+    writefile = _via_open("writefile")
+    appendbytes = _via_open("appendbytes")
+    appendtext = _via_open("appendtext")
+    copy = _via_open("copy")
+
+    def copydir(self, src_path, dst_path, *args, **kwargs):
+        self._check_new(dst_path)
+        return FS.copydir(self, src_path, dst_path, *args, **kwargs)
@@ -0,0 +1,98 @@
+import hashlib
+import os
+from config import CLOUD_ROOT, STORAGE_ROOTS, SHARD_DEPTH, SHARD_WIDTH
+
+
+# migrate_layout 跨设备迁移时的临时目录后缀: 新位置的副本和移开的旧目录
+MIGRATING_SUFFIX = ".migrating"
+MIGRATED_SUFFIX = ".migrated"
+
+
+class UserMigrating(Exception):
+    # 用户目录正在跨设备迁移, 稍后重试
+    pass
+
+
+def _digest(username: str) -> str:
+    return hashlib.sha1(username.encode("utf-8")).hexdigest()
+
+
+def shard_parts(username: str) -> list[str]:
+    digest = _digest(username)
+    return [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+
+
+def storage_root(username: str) -> str:
+    return STORAGE_ROOTS[int(_digest(username), 16) % len(STORAGE_ROOTS)]
+
+
+def target_path(username: str) -> str:
+    # 按当前配置用户目录应在的位置, 只做计算不访问磁盘
+    return os.path.join(storage_root(username), *shard_parts(username), username)
+
+
+def _candidates(username: str) -> list[str]:
+    # 迁移期间用户目录可能还在旧位置: 平铺的 CLOUD_ROOT 下或者其他根目录下
+    paths = [target_path(username), os.path.join(CLOUD_ROOT, username)]
+    paths.extend(os.path.join(root, *shard_parts(username), username) for root in STORAGE_ROOTS)
+    return list(dict.fromkeys(paths))
+
+
+def user_root(username: str) -> str:
+    # 用户适配器所在的目录, 由用户名计算, 迁移期间最多几次 stat, 不扫描目录; 还不存在的用户返回目标位置
+    candidates = _candidates(username)
+    for path in candidates:
+        if os.path.isdir(path):
+            return path
+    # 旧目录已移开、副本还没改名到位: 不能在目标位置新建一个空目录
+    for path in candidates:
+        if os.path.isdir(path + MIGRATING_SUFFIX) or os.path.isdir(path + MIGRATED_SUFFIX):
+            raise UserMigrating(username)
+    return target_path(username)
+
+
+def _is_shard(name: str) -> bool:
+    return len(name) == SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)
+
+
+def _walk(root: str, parts: list[str], depth: int):
+    directory = os.path.join(root, *parts)
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        if depth == 0:
+            # 只认哈希前缀匹配的目录, 避免把名字恰好像分片的旧用户目录当成分片
+            if shard_parts(entry.name) == parts:
+                yield entry.name, entry.path
+        elif _is_shard(entry.name):
+            yield from _walk(root, parts + [entry.name], depth - 1)
+
+
+def iter_users():
+    # 磁盘上所有用户目录的 (username, path), 包括还在平铺旧布局下的用户, 跳过迁移留下的符号链接
+    for root in dict.fromkeys(STORAGE_ROOTS + [CLOUD_ROOT]):
+        yield from _walk(root, [], SHARD_DEPTH)
+
+    if SHARD_DEPTH > 0 and os.path.isdir(CLOUD_ROOT):
+        for entry in os.scandir(CLOUD_ROOT):
+            if entry.name.endswith((MIGRATING_SUFFIX, MIGRATED_SUFFIX)):
+                continue
+            if entry.is_dir(follow_symlinks=False) and not _is_shard(entry.name):
+                yield entry.name, entry.path
+
+
+def parse_syspath(syspath: str) -> tuple[str, str, str] | None:
+    # {root}/{shards}/{username}/{adapter}/... -> (username, adapter, path)
+    for root in dict.fromkeys(STORAGE_ROOTS + [CLOUD_ROOT]):
+        parts = os.path.relpath(syspath, os.path.abspath(root)).split(os.sep)
+        if parts[0] == "..":
+            continue
+        if len(parts) >= SHARD_DEPTH + 2 and shard_parts(parts[SHARD_DEPTH]) == parts[:SHARD_DEPTH]:
+            parts = parts[SHARD_DEPTH:]
+        if len(parts) >= 3:
+            return parts[0], parts[1], "/" + "/".join(parts[2:])
+    return None
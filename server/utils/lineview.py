@@ -0,0 +1,150 @@
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from config import VIEW_BLOCK_SIZE, VIEW_MAX_LINES, VIEW_MAX_LINE_BYTES, VIEW_CACHE_ENTRIES
+
+
+class LineIndex(object):
+    # 稀疏行索引: counts[i] 为前 i 个整块中的换行符数, 内存占用与文件大小 / block_size 成正比
+    def __init__(self, stat: os.stat_result, block_size: int = VIEW_BLOCK_SIZE):
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.block_size = block_size
+        self.counts = array("q", [0])
+        self.mark = b""
+        self.lock = threading.Lock()
+
+    @property
+    def indexed(self) -> int:
+        return (len(self.counts) - 1) * self.block_size
+
+    def update(self, mm: mmap.mmap, size: int):
+        # 只索引完整的块, 追加写入的日志下次只需补上新增的块
+        with self.lock:
+            # 已索引部分的末尾内容变了说明文件被截断后又重新写入
+            if mm[self.indexed - len(self.mark):self.indexed] != self.mark:
+                self.counts = array("q", [0])
+                self.mark = b""
+            while self.indexed + self.block_size <= size:
+                start = self.indexed
+                self.counts.append(self.counts[-1] + mm[start:start + self.block_size].count(b"\n"))
+                self.mark = mm[self.indexed - 64:self.indexed]
+
+    def line_at(self, mm: mmap.mmap, offset: int) -> int:
+        # offset 之前的换行符数, 即 offset 所在行的行号 (从 0 开始)
+        block = min(offset // self.block_size, len(self.counts) - 1)
+        start = block * self.block_size
+        return self.counts[block] + mm[start:offset].count(b"\n")
+
+    def total(self, mm: mmap.mmap, size: int) -> int:
+        lines = self.line_at(mm, size)
+        return lines + 1 if size and mm[size - 1] != 0x0A else lines
+
+    def offset_of(self, mm: mmap.mmap, size: int, line: int) -> int:
+        # 第 line 行 (从 0 开始) 的起始位置, 最多在一个块内逐行查找
+        if line <= 0:
+            return 0
+        block = max(bisect_left(self.counts, line) - 1, 0)
+        pos = block * self.block_size
+        for _ in range(line - self.counts[block]):
+            pos = mm.find(b"\n", pos, size)
+            if pos < 0:
+                return size
+            pos += 1
+        return pos
+
+
+class LineIndexCache(object):
+    def __init__(self, maxsize: int = VIEW_CACHE_ENTRIES):
+        self.maxsize = maxsize
+        self._indexes: OrderedDict[str, LineIndex] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, syspath: str, stat: os.stat_result, size: int) -> LineIndex:
+        with self._lock:
+            index = self._indexes.pop(syspath, None)
+            # 文件被替换或截断后重建索引
+            if index is None or index.identity != (stat.st_dev, stat.st_ino) or index.indexed > size:
+                index = LineIndex(stat)
+            self._indexes[syspath] = index
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+            return index
+
+
+line_indexes = LineIndexCache()
+
+
+def _decode(line: bytes) -> str:
+    if len(line) > VIEW_MAX_LINE_BYTES:
+        line = line[:VIEW_MAX_LINE_BYTES]
+    return line.rstrip(b"\r").decode("utf-8", errors="replace")
+
+
+def _forward(mm: mmap.mmap, start: int, size: int, count: int, complete: bool) -> tuple[list[str], int]:
+    # 从 start 开始读取最多 count 行, complete 为 True 时不返回还没写完的最后一行
+    lines = []
+    pos = start
+    while pos < size and len(lines) < count:
+        end = mm.find(b"\n", pos, size)
+        if end < 0:
+            if complete:
+                break
+            end = size
+        lines.append(_decode(mm[pos:min(end, pos + VIEW_MAX_LINE_BYTES)]))
+        pos = min(end + 1, size)
+    return lines, pos
+
+
+def _backward(mm: mmap.mmap, size: int, count: int) -> int:
+    # 末尾 count 行的起始位置
+    end = size - 1 if size and mm[size - 1] == 0x0A else size
+    pos = end
+    for _ in range(count):
+        if pos <= 0:
+            return 0
+        pos = mm.rfind(b"\n", 0, pos)
+        if pos < 0:
+            return 0
+    return pos + 1
+
+
+def read_lines(syspath: str, mode: str = "head", line: int = 1, count: int = 100, offset: int = 0) -> dict:
+    # 读取本地文本文件的一段行: head, tail, line (从第 line 行开始, 从 1 计), follow (offset 之后写完的行)
+    # 只访问请求的窗口和一个索引块; head 的 total 在索引覆盖整个文件之前为 None
+    count = max(1, min(count, VIEW_MAX_LINES))
+    with open(syspath, "rb") as f:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        # 文件被截断 (例如日志轮转) 时 follow 从头开始
+        reset = mode == "follow" and offset > size
+        result = {"lines": [], "first": 1, "total": 0, "offset": 0, "size": size, "reset": reset}
+        if size == 0:
+            return result
+
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            index = line_indexes.get(syspath, stat, size)
+            # head 不需要行索引, 只在剩下不到一个块时顺便补齐, 不为了 total 扫描整个文件
+            if mode != "head" or size - index.indexed < index.block_size:
+                index.update(mm, size)
+            covered = size - index.indexed < index.block_size
+
+            if mode == "tail":
+                start = _backward(mm, size, count)
+            elif mode == "line":
+                start = index.offset_of(mm, size, line - 1)
+            elif mode == "follow":
+                start = 0 if reset else offset
+            else:
+                start = 0
+
+            lines, end = _forward(mm, start, size, count, mode == "follow")
+            result.update(
+                lines=lines,
+                first=index.line_at(mm, start) + 1,
+                total=index.total(mm, size) if covered else None,
+                offset=end,
+            )
+            return result
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from fs import errors
+from fs import path as fspath
+from fs.base import FS
+from fs.copy import copy_file_internal
+from config import MOVE_WORKERS, MOVE_VERIFY
+
+
+def _syspath(fs: FS, path: str) -> str | None:
+    try:
+        return fs.getsyspath(path)
+    except errors.NoSysPath:
+        return None
+
+
+def _same_device(src: str, dst: str) -> bool:
+    return os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev
+
+
+def _digest(fs: FS, path: str) -> str:
+    sha = hashlib.sha256()
+    with fs.openbin(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _copy_file(src_fs: FS, src_path: str, dst_fs: FS, dst_path: str):
+    src_sys, dst_sys = _syspath(src_fs, src_path), _syspath(dst_fs, dst_path)
+    if src_sys is not None and dst_sys is not None:
+        # 本地到本地, shutil 会使用 copy_file_range / sendfile
+        shutil.copy2(src_sys, dst_sys)
+    else:
+        copy_file_internal(src_fs, src_path, dst_fs, dst_path, preserve_time=True)
+
+    if MOVE_VERIFY == "hash":
+        ok = _digest(src_fs, src_path) == _digest(dst_fs, dst_path)
+    else:
+        ok = src_fs.getsize(src_path) == dst_fs.getsize(dst_path)
+    if not ok:
+        raise errors.OperationFailed(dst_path, msg=f"verification of {dst_path} failed")
+
+
+def _copy_tree(src_fs: FS, src_path: str, dst_fs: FS, dst_path: str, workers: int):
+    dst_fs.makedirs(dst_path, recreate=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for dir_path, dirs, files in src_fs.walk.walk(src_path):
+            target = fspath.join(dst_path, fspath.relativefrom(src_path, dir_path))
+            for info in dirs:
+                dst_fs.makedirs(fspath.join(target, info.name), recreate=True)
+            for info in files:
+                futures.append(executor.submit(
+                    _copy_file, src_fs, fspath.join(dir_path, info.name), dst_fs, fspath.join(target, info.name)
+                ))
+        for future in futures:
+            future.result()
+
+
+def move(src_fs: FS, src_path: str, dst_fs: FS, dst_path: str, workers: int = MOVE_WORKERS):
+    # 移动文件或目录, 可以跨文件系统: 同设备时是一次 os.rename, 与目录大小无关
+    # 否则并行复制并校验之后才删除源文件
+    src_path, dst_path = fspath.abspath(src_path), fspath.abspath(dst_path)
+    if not src_fs.exists(src_path):
+        raise errors.ResourceNotFound(src_path)
+    is_dir = src_fs.isdir(src_path)
+    dst_exists = dst_fs.exists(dst_path)
+    # 只写一次的文件系统 (ImmutableFS) 不能移出, 也不能合并到已有目录中
+    if getattr(src_fs, "write_once", False):
+        raise errors.ResourceReadOnly(src_path, msg=f"{src_path} is immutable")
+    if dst_exists and getattr(dst_fs, "write_once", False):
+        raise errors.ResourceReadOnly(dst_path, msg=f"{dst_path} is immutable")
+    if dst_exists and not (is_dir and dst_fs.isdir(dst_path)):
+        raise errors.DestinationExists(dst_path)
+    if is_dir and src_fs is dst_fs and fspath.isparent(src_path, dst_path):
+        raise errors.OperationFailed(dst_path, msg=f"cannot move {src_path} into itself")
+
+    src_sys, dst_sys = _syspath(src_fs, src_path), _syspath(dst_fs, dst_path)
+    if not dst_exists and src_sys is not None and dst_sys is not None and _same_device(src_sys, dst_sys):
+        os.rename(src_sys, dst_sys)
+        return
+
+    if src_fs is dst_fs and not dst_exists:
+        # 同一个非本地文件系统, 交给后端自己的 move
+        if is_dir:
+            src_fs.movedir(src_path, dst_path, create=True)
+        else:
+            src_fs.move(src_path, dst_path)
+        return
+
+    try:
+        if is_dir:
+            _copy_tree(src_fs, src_path, dst_fs, dst_path, workers)
+        else:
+            _copy_file(src_fs, src_path, dst_fs, dst_path)
+    except Exception:
+        # 复制失败时保留源文件, 清理不完整的目标
+        if not dst_exists and dst_fs.exists(dst_path):
+            if dst_fs.isdir(dst_path):
+                dst_fs.removetree(dst_path)
+            else:
+                dst_fs.remove(dst_path)
+        raise
+
+    if is_dir:
+        src_fs.removetree(src_path)
+    else:
+        src_fs.remove(src_path)
@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import hmac
+import time
+from urllib.parse import urlencode
+from fastapi import HTTPException, Request
+from utils.auth import SECRET_KEY, require_user
+from config import SIGNED_URL_EXPIRE_SECONDS, PUBLIC_DOWNLOADS
+
+# 与登录令牌使用不同的派生密钥
+_KEY = hmac.new(SECRET_KEY.encode(), b"vuefinder-signed-url", hashlib.sha256).digest()
+
+
+def _signature(username: str, q: str, adapter: str, path: str, expires: int) -> str:
+    message = "\n".join([username, q, adapter, path, str(expires)]).encode("utf-8")
+    digest = hmac.new(_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode("ascii")
+
+
+def sign_params(username: str, q: str, adapter: str, path: str, expires_in: int = SIGNED_URL_EXPIRE_SECONDS) -> dict:
+    # 过期时间取整到 expires_in 的整数倍, 同一时间段内的链接相同, 便于共享缓存命中
+    expires = (int(time.time()) // expires_in + 2) * expires_in
+    return {
+        "q": q,
+        "adapter": adapter,
+        "path": path,
+        "expires": expires,
+        "sig": _signature(username, q, adapter, path, expires),
+    }
+
+
+def sign_url(base: str, username: str, q: str, adapter: str, path: str) -> str:
+    return f"{base}?{urlencode(sign_params(username, q, adapter, path))}"
+
+
+def verify(request: Request, username: str) -> int | None:
+    # 签名有效时返回剩余秒数, 没有签名返回 None, 签名无效或过期抛出 403
+    params = request.query_params
+    sig = params.get("sig")
+    if sig is None:
+        return None
+    try:
+        expires = int(params.get("expires", ""))
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    expected = _signature(username, params.get("q", ""), params.get("adapter", ""), params.get("path", ""), expires)
+    if not hmac.compare_digest(sig, expected):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    remaining = expires - int(time.time())
+    if remaining <= 0:
+        raise HTTPException(status_code=403, detail="Signature expired")
+    return remaining
+
+
+async def authorize_download(request: Request, username: str) -> str:
+    # 检查 preview/download 的访问权限并返回 Cache-Control
+    # 签名链接不查数据库和令牌, 共享缓存可保存到过期; 否则需要 username 本人的令牌
+    remaining = verify(request, username)
+    if remaining is not None:
+        return f"public, max-age={remaining}"
+    if PUBLIC_DOWNLOADS:
+        return "no-cache"
+
+    await require_user(request, username)
+    return "private, max-age=0"
@@ -0,0 +1,76 @@
+import os
+from urllib.parse import quote
+from fs.base import FS
+from fs import errors
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response
+from config import DOWNLOAD_CHUNK_SIZE, STORAGE_ROOTS, OFFLOAD_MODE, OFFLOAD_PREFIX
+
+
+def get_syspath(fs: FS, path: str) -> str | None:
+    # 仅 OSFS 等本地文件系统有系统路径
+    try:
+        return fs.getsyspath(path)
+    except errors.NoSysPath:
+        return None
+
+
+def _offload_path(syspath: str) -> str | None:
+    # 相对于所在存储根目录的路径, 多个根目录时加上序号; 还没迁移的旧目录不交给代理
+    for i, root in enumerate(STORAGE_ROOTS):
+        relpath = os.path.relpath(syspath, os.path.abspath(root))
+        if not relpath.startswith(".."):
+            prefix = f"{i}/" if len(STORAGE_ROOTS) > 1 else ""
+            return prefix + relpath.replace(os.sep, "/")
+    return None
+
+
+def offload_response(syspath: str, headers: dict, media_type: str) -> Response | None:
+    # 只返回响应头, 文件内容由 nginx 等前端代理直接发送
+    if OFFLOAD_MODE == "x-accel-redirect":
+        relpath = _offload_path(syspath)
+        if relpath is None:
+            return None
+        headers["X-Accel-Redirect"] = f"{OFFLOAD_PREFIX}/{quote(relpath)}"
+    elif OFFLOAD_MODE == "x-sendfile":
+        headers["X-Sendfile"] = syspath
+    else:
+        return None
+    return Response(headers=headers, media_type=media_type)
+
+
+class SendfileResponse(FileResponse):
+    # 服务器支持 zerocopysend 扩展时由内核 sendfile 直接发送, 否则退回 FileResponse 的分块读取
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        range_request = any(key == b"range" for key, _ in scope.get("headers", []))
+        if "http.response.zerocopysend" not in extensions or range_request:
+            return await super().__call__(scope, receive, send)
+
+        if self.stat_result is None:
+            self.set_stat_headers(await run_in_threadpool(os.stat, self.path))
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file, "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_file(fs: FS, path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    # 非本地文件系统按固定大小分块读取, 读操作放到线程池中避免阻塞事件循环
+    file = await run_in_threadpool(fs.openbin, path)
+    try:
+        while True:
+            chunk = await run_in_threadpool(file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await run_in_threadpool(file.close)
@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from config import TRACE_SLOW_SECONDS, PROFILE_SAMPLE_RATE, PROFILE_HEADER, PROFILE_KEEP, PROFILE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+_ids = itertools.count(1)
+
+
+class Trace(object):
+    # 一次请求的各阶段耗时, 同名阶段累加
+    def __init__(self, name: str, username: str):
+        self.id = next(_ids)
+        self.name = name
+        self.username = username
+        self.started = time.time()
+        self.spans: Counter[str] = Counter()
+        self.duration = 0.0
+        self.sampler: StackSampler | None = None
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "endpoint": self.name,
+            "username": self.username,
+            "started": self.started,
+            "duration": self.duration,
+            "spans": dict(self.spans),
+        }
+
+
+@contextlib.contextmanager
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans[name] += time.perf_counter() - start
+
+
+class StackSampler(object):
+    # 定时采样一个请求的调用栈, 输出 flamegraph 可用的折叠格式
+    # 事件循环线程只在本请求的 task 运行时采样; 经 to_thread 交给线程的工作也采样, 以 thread:<名称> 为根
+    # 其他线程 (如 mover 的复制线程) 不采样
+    def __init__(self, thread_id: int, task: asyncio.Task | None = None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.task = task
+        self.interval = interval
+        self.workers: set[int] = set()
+        self.stacks: Counter[str] = Counter()
+        self._loop = task.get_loop() if task is not None else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _running(self) -> bool:
+        # 事件循环上当前运行的是否为本请求的 task
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+        if self.task is None or current_tasks is None:
+            return True
+        return current_tasks.get(self._loop) is self.task
+
+    def _record(self, frame, root: str | None = None):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        if root is not None:
+            stack.append(root)
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self._running():
+                self._record(frames.get(self.thread_id))
+            for ident in list(self.workers):
+                if ident not in names:
+                    names[ident] = next((t.name for t in threading.enumerate() if t.ident == ident), str(ident))
+                self._record(frames.get(ident), f"thread:{names[ident]}")
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore(object):
+    # 只保留最慢的 N 个请求的采样结果
+    def __init__(self, keep: int = PROFILE_KEEP):
+        self.keep = keep
+        self._heap: list[tuple[float, int, Trace]] = []
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            item = (trace.duration, trace.id, trace)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+            elif item > self._heap[0]:
+                heapq.heapreplace(self._heap, item)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            traces = sorted((trace for _, _, trace in self._heap), key=lambda t: t.duration, reverse=True)
+        return [trace.summary() for trace in traces]
+
+    def get(self, id: int) -> Trace | None:
+        with self._lock:
+            return next((trace for _, trace_id, trace in self._heap if trace_id == id), None)
+
+
+profiles = ProfileStore()
+
+
+def profile_requested(headers) -> bool:
+    # 调用方需确认请求来自管理员, 否则任何人都能触发采样
+    return bool(PROFILE_HEADER and headers.get(PROFILE_HEADER))
+
+
+def start_profiling(trace: Trace):
+    # 在处理请求的 task 中调用
+    if trace.sampler is None:
+        trace.sampler = StackSampler(threading.get_ident(), asyncio.current_task())
+        trace.sampler.start()
+
+
+async def to_thread(func, *args, **kwargs):
+    # 与 asyncio.to_thread 相同, 请求被采样时工作线程的调用栈也计入该请求
+    trace = _current.get()
+    sampler = trace.sampler if trace is not None else None
+    if sampler is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    def run():
+        ident = threading.get_ident()
+        sampler.workers.add(ident)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.workers.discard(ident)
+
+    return await asyncio.to_thread(run)
+
+
+@contextlib.contextmanager
+def trace_request(name: str, username: str):
+    trace = Trace(name, username)
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        start_profiling(trace)
+    token = _current.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - start
+        _current.reset(token)
+        if trace.sampler is not None:
+            trace.sampler.stop()
+            profiles.add(trace)
+        if trace.duration >= TRACE_SLOW_SECONDS:
+            logger.warning(
+                "slow request %s user=%s %.3fs %s",
+                name,
+                username,
+                trace.duration,
+                " ".join(f"{k}={v:.3f}s" for k, v in trace.spans.items()),
+            )
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import secrets
+import time
+from itertools import islice
+from fs import errors
+from fs import path as fspath
+from fs.base import FS
+from utils import mover
+from config import TRASH_RETENTION_SECONDS, TRASH_PURGE_RATE, TRASH_PURGE_BATCH, TRASH_PURGE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 每个适配器根目录下的隐藏回收站, 与数据在同一文件系统上, 删除只是一次重命名
+TRASH_DIR = "/.trash"
+_PURGING = ".purge-"
+
+
+def _meta_path(id: str) -> str:
+    return fspath.join(TRASH_DIR, id + ".json")
+
+
+def is_trash_path(path: str) -> bool:
+    return fspath.isparent(TRASH_DIR, fspath.abspath(path))
+
+
+def move_to_trash(fs: FS, path: str) -> str:
+    path = fspath.abspath(path)
+    if not fs.exists(path):
+        raise errors.ResourceNotFound(path)
+    id = f"{int(time.time())}-{secrets.token_hex(4)}"
+    entry = fspath.join(TRASH_DIR, id)
+    fs.makedirs(TRASH_DIR, recreate=True)
+    # 先写元数据再建目录, 没有元数据的目录一定是可以清理的残留
+    fs.writetext(_meta_path(id), json.dumps({
+        "path": path,
+        "type": "dir" if fs.isdir(path) else "file",
+        "deleted": time.time(),
+    }))
+    fs.makedir(entry)
+    mover.move(fs, path, fs, fspath.join(entry, fspath.basename(path)))
+    return id
+
+
+def list_trash(fs: FS) -> list[dict]:
+    if not fs.isdir(TRASH_DIR):
+        return []
+    items = []
+    for name in fs.listdir(TRASH_DIR):
+        if not name.endswith(".json") or name.startswith(_PURGING):
+            continue
+        try:
+            meta = json.loads(fs.readtext(fspath.join(TRASH_DIR, name)))
+        except (errors.ResourceNotFound, ValueError):
+            continue
+        items.append(dict(meta, id=name[:-len(".json")]))
+    items.sort(key=lambda item: item["deleted"], reverse=True)
+    return items
+
+
+def restore(fs: FS, id: str) -> str:
+    meta = json.loads(fs.readtext(_meta_path(id)))
+    path = meta["path"]
+    if fs.exists(path):
+        raise errors.DestinationExists(path)
+    fs.makedirs(fspath.dirname(path), recreate=True)
+    mover.move(fs, fspath.join(TRASH_DIR, id, fspath.basename(path)), fs, path)
+    fs.removetree(fspath.join(TRASH_DIR, id))
+    fs.remove(_meta_path(id))
+    return path
+
+
+def mark_purge(fs: FS, id: str):
+    # 改名后立即从回收站列表中消失, 由后台任务慢慢删除
+    fs.remove(_meta_path(id))
+    mover.move(fs, fspath.join(TRASH_DIR, id), fs, fspath.join(TRASH_DIR, _PURGING + id))
+
+
+def _expire(fs: FS, now: float) -> list[str]:
+    if not fs.isdir(TRASH_DIR):
+        return []
+    for item in list_trash(fs):
+        if item["deleted"] + TRASH_RETENTION_SECONDS <= now:
+            mark_purge(fs, item["id"])
+    # 没有元数据的目录是中断操作留下的残留, 一并清理
+    for name in fs.listdir(TRASH_DIR):
+        if not name.endswith(".json") and not name.startswith(_PURGING) and not fs.exists(_meta_path(name)):
+            mover.move(fs, fspath.join(TRASH_DIR, name), fs, fspath.join(TRASH_DIR, _PURGING + name))
+    return [fspath.join(TRASH_DIR, name) for name in fs.listdir(TRASH_DIR) if name.startswith(_PURGING)]
+
+
+def _removals(fs: FS, path: str):
+    # 自底向上逐个删除, 每次只产生一个删除操作, 便于限速
+    stack = [(path, fs.scandir(path))]
+    while stack:
+        dir_path, infos = stack[-1]
+        info = next(infos, None)
+        if info is None:
+            stack.pop()
+            yield fs.removedir, dir_path
+        elif info.is_dir:
+            sub_path = fspath.join(dir_path, info.name)
+            stack.append((sub_path, fs.scandir(sub_path)))
+        else:
+            yield fs.remove, fspath.join(dir_path, info.name)
+
+
+async def _purge_tree(fs: FS, path: str):
+    removals = _removals(fs, path)
+
+    def run_batch() -> int:
+        count = 0
+        for remove, item_path in islice(removals, TRASH_PURGE_BATCH):
+            try:
+                remove(item_path)
+            except errors.DirectoryNotEmpty:
+                fs.removetree(item_path)
+            except errors.ResourceNotFound:
+                pass
+            count += 1
+        return count
+
+    while True:
+        count = await asyncio.to_thread(run_batch)
+        if count == 0:
+            break
+        await asyncio.sleep(count / TRASH_PURGE_RATE)
+
+
+async def purge(fs: FS):
+    for path in await asyncio.to_thread(_expire, fs, time.time()):
+        await _purge_tree(fs, path)
+
+
+async def purge_forever(iter_adapters):
+    # 后台任务: 定期清理过期条目, 按 TRASH_PURGE_RATE 限速删除
+    while True:
+        for fs in iter_adapters():
+            try:
+                await purge(fs)
+            except Exception:
+                logger.exception("failed to purge trash of %r", fs)
+        await asyncio.sleep(TRASH_PURGE_INTERVAL)
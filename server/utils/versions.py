@@ -0,0 +1,56 @@
+import secrets
+import threading
+from collections import OrderedDict
+from fs import errors
+from fs.base import FS
+
+# 每次启动不同, 重启后客户端持有的版本号全部失效
+BOOT_ID = secrets.token_hex(4)
+
+
+class DirectoryVersions(object):
+    # 目录版本号: 目录内容每次变化时分配一个全局递增的序号
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._counter = 0
+        self._floor = 0
+        self._versions: OrderedDict[tuple[str, str, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self, username: str, adapter: str, path: str) -> tuple[int, int]:
+        # 返回修改前后的版本号
+        with self._lock:
+            self._counter += 1
+            key = (username, adapter, path)
+            previous = self._versions.pop(key, self._floor)
+            self._versions[key] = self._counter
+            while len(self._versions) > self.maxsize:
+                # 被淘汰的目录统一使用 floor, 只会让旧版本号失效, 不会误判为最新
+                _, version = self._versions.popitem(last=False)
+                self._floor = max(self._floor, version)
+            return previous, self._counter
+
+    def get(self, username: str, adapter: str, path: str) -> int:
+        with self._lock:
+            return self._versions.get((username, adapter, path), self._floor)
+
+
+directory_versions = DirectoryVersions()
+
+
+def version_token(fs: FS, username: str, adapter: str, path: str) -> str:
+    # 加上目录的修改时间, 未被监听到的外部增删也会使版本号变化
+    try:
+        modified = fs.getinfo(path, ["details"]).modified
+    except errors.ResourceNotFound:
+        modified = None
+    stamp = int(modified.timestamp() * 1000000) if modified else 0
+    return f"{BOOT_ID}.{directory_versions.get(username, adapter, path)}.{stamp}"
+
+
+def token_counter(token: str) -> int | None:
+    # version_token 中的目录版本号
+    try:
+        return int(token.split(".")[1])
+    except (IndexError, ValueError):
+        return None
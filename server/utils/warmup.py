@@ -0,0 +1,76 @@
+import asyncio
+import importlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+from utils.file_operations import get_user_adapters
+from utils.immutable import ImmutableFS
+from config import WARMUP_USERS, WARMUP_FILE, WARMUP_MAX_USERS
+
+logger = logging.getLogger(__name__)
+
+# 按需加载的模块, 启动后在后台线程中提前导入, 第一个用到它们的请求不用再等
+LAZY_MODULES = ["PIL.Image", "fs.zipfs", "passlib.context"]
+
+# 本 worker 实际处理过请求的用户, 最近的在最后
+served_users: OrderedDict[str, None] = OrderedDict()
+
+
+def record_user(username: str):
+    served_users.pop(username, None)
+    served_users[username] = None
+    while len(served_users) > WARMUP_MAX_USERS:
+        served_users.popitem(last=False)
+
+
+def _load_users() -> list[str]:
+    try:
+        with open(WARMUP_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def hot_users() -> list[str]:
+    return list(dict.fromkeys(WARMUP_USERS + _load_users()))[:WARMUP_MAX_USERS]
+
+
+def save_users():
+    # 本 worker 最近处理过请求的用户排在前面, 与其他 worker 已写入的合并
+    users = list(dict.fromkeys(list(reversed(served_users)) + _load_users()))[:WARMUP_MAX_USERS]
+    os.makedirs(os.path.dirname(WARMUP_FILE) or ".", exist_ok=True)
+    with open(WARMUP_FILE + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(users, f)
+    os.replace(WARMUP_FILE + ".tmp", WARMUP_FILE)
+
+
+def _warm_user(username: str):
+    for fs in get_user_adapters(username).values():
+        if isinstance(fs, ImmutableFS):
+            fs.manifest()
+
+
+def _import_lazy_modules():
+    from utils.auth import get_pwd_context
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+    # bcrypt 后端在第一次使用时才加载
+    get_pwd_context().hash("warmup")
+
+
+async def warm_up():
+    # 新 worker 接受请求前: 加载 mime 表, 打开热门用户的适配器
+    # 按需导入的重模块之后在后台线程中加载, 不拖慢启动
+    start = time.perf_counter()
+    mimetypes.init()
+    users = hot_users()
+    for username in users:
+        try:
+            await asyncio.to_thread(_warm_user, username)
+        except Exception as exc:
+            logger.warning("warm-up of %s failed: %s", username, exc)
+    logger.info("warmed up %d users in %.3fs", len(users), time.perf_counter() - start)
+    return asyncio.create_task(asyncio.to_thread(_import_lazy_modules))
@@ -2,8 +2,10 @@ from http import HTTPStatus
 from typing import Iterable, Mapping
 from werkzeug.wrappers import Request, Response
 from werkzeug.exceptions import BadRequest
+from werkzeug.wsgi import wrap_file
 from fs.base import FS
 from fs.info import Info
+from fs.osfs import OSFS
 from fs.subfs import SubFS
 from fs.zipfs import ZipFS
 from fs import path as fspath, errors, copy, walk
@@ -11,10 +13,15 @@ import json
 import mimetypes
 from shutil import copyfileobj
 from collections import OrderedDict
+from itertools import count
 from pathvalidate import is_valid_filename
 import io
+import os
+import secrets
+import threading
 
 from vuefinder import Adapter, to_vuefinder_resource
+from tracing import trace_request, span
 
 
 def fill_fs(fs: FS, d: dict):
@@ -30,6 +37,9 @@ def fill_fs(fs: FS, d: dict):
             fill_fs(SubFS(fs, k), v)
 
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
 def json_response(response, status: int = 200) -> Response:
     payload = json.dumps(response)
     return Response(
@@ -41,7 +51,7 @@ def json_response(response, status: int = 200) -> Response:
 
 
 class VuefinderApp(object):
-    def __init__(self, enable_cors: bool = False):
+    def __init__(self, enable_cors: bool = False, slow_request_seconds: float = 1.0):
         self.endpoints = {
             "GET:index": self._index,
             "GET:preview": self._preview,
@@ -62,6 +72,12 @@ class VuefinderApp(object):
         self._default: Adapter | None = None
         self._adapters: dict[str, FS] = OrderedDict()
         self.enable_cors = enable_cors
+        self.slow_request_seconds = slow_request_seconds
+        # 目录版本号, 用于 delta 响应
+        self._boot_id = secrets.token_hex(4)
+        self._versions: dict[tuple[str, str], int] = {}
+        self._version_counter = count(1)
+        self._versions_lock = threading.Lock()
 
     def add_fs(self, key: str, fs: FS):
         self._adapters[key] = fs
@@ -90,28 +106,89 @@ class VuefinderApp(object):
         return fspath.abspath(path)
 
     def delegate(self, request: Request) -> tuple[FS, str]:
-        adapter = self._get_adapter(request)
-        path = self._get_full_path(request)
+        with span("delegate"):
+            adapter = self._get_adapter(request)
+            path = self._get_full_path(request)
         return adapter.fs, self._fs_path(path)
 
     def _index(self, request: Request, filter: str | None = None) -> Response:
         adapter = self._get_adapter(request)
         fs, path = self.delegate(request)
-        infos = list(fs.scandir(path, namespaces=["basic", "details"]))
+        with span("storage"):
+            version = self._version(request)
+            infos = list(fs.scandir(path, namespaces=["basic", "details"]))
 
         if filter:
             infos = [info for info in infos if filter in info.name]
 
         infos.sort(key=lambda i: ("0_" if i.is_dir else "1_") + i.name.lower())
 
+        with span("serialize"):
+            return json_response(
+                {
+                    "adapter": adapter.key,
+                    "storages": self._get_storages(),
+                    "dirname": self._get_full_path(request),
+                    "version": version,
+                    "files": [
+                        to_vuefinder_resource(adapter.key, path, info) for info in infos
+                    ],
+                }
+            )
+
+    def _version(self, request: Request) -> str:
+        adapter = self._get_adapter(request)
+        fs, path = self.delegate(request)
+        try:
+            modified = fs.getinfo(path, ["details"]).modified
+        except errors.ResourceNotFound:
+            modified = None
+        stamp = int(modified.timestamp() * 1000000) if modified else 0
+        return f"{self._boot_id}.{self._versions.get((adapter.key, path), 0)}.{stamp}"
+
+    def _delta(self, request: Request, base_version: str, changes: list[tuple]) -> Response:
+        # delta=1 且客户端版本号与修改前一致时只返回变化的条目, 否则返回完整列表
+        adapter = self._get_adapter(request)
+        fs, path = self.delegate(request)
+        with self._versions_lock:
+            # 期间其他请求修改过当前目录时也返回完整列表
+            alone = self._versions.get((adapter.key, path), 0) == int(base_version.split(".")[1])
+            for _, src, dst in changes:
+                for changed in (src, dst):
+                    if changed is not None:
+                        self._versions[(adapter.key, fspath.dirname(changed))] = next(self._version_counter)
+            version = self._version(request)
+
+        if (
+            request.args.get("delta") not in ("1", "true")
+            or request.args.get("version") != base_version
+            or not alone
+        ):
+            return self._index(request)
+
+        entries = {}
+        for type, src, dst in changes:
+            if fspath.dirname(src) == path:
+                entries[src] = "removed" if type in ("deleted", "moved") else type
+            if dst is not None and fspath.dirname(dst) == path:
+                entries[dst] = "created"
+
+        added, removed, changed = [], [], []
+        for item_path, type in entries.items():
+            if type == "removed" or not fs.exists(item_path):
+                removed.append(f"{adapter.key}:/{item_path}")
+                continue
+            info = fs.getinfo(item_path, ["basic", "details"])
+            resource = to_vuefinder_resource(adapter.key, path, info)
+            (added if type == "created" else changed).append(resource)
+
         return json_response(
             {
                 "adapter": adapter.key,
                 "storages": self._get_storages(),
                 "dirname": self._get_full_path(request),
-                "files": [
-                    to_vuefinder_resource(adapter.key, path, info) for info in infos
-                ],
+                "version": version,
+                "delta": {"added": added, "removed": removed, "changed": changed},
             }
         )
 
@@ -125,9 +202,15 @@ class VuefinderApp(object):
         if info.size is not None:
             headers["Content-Length"] = info.size
 
+        # OSFS 直接打开系统文件, 让服务器的 wsgi.file_wrapper 可以使用 sendfile
+        try:
+            file = open(fs.getsyspath(path), "rb")
+        except errors.NoSysPath:
+            file = fs.openbin(path)
+
         # CREDIT: https://stackoverflow.com/a/56184787/3140799
         return Response(
-            fs.open(path, "rb"),
+            wrap_file(request.environ, file, DOWNLOAD_CHUNK_SIZE),
             direct_passthrough=True,
             mimetype="application/octet-stream",
             headers=headers,
@@ -169,53 +252,71 @@ class VuefinderApp(object):
         return self._index(request, filter)
 
     def _newfolder(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, path = self.delegate(request)
         name = request.get_json().get("name", "")
         fs.makedir(fspath.join(path, name))
-        return self._index(request)
+        return self._delta(request, base_version, [("created", fspath.join(path, name), None)])
 
     def _newfile(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, path = self.delegate(request)
         name = request.get_json().get("name", "")
         fs.writetext(fspath.join(path, name), "")
-        return self._index(request)
+        return self._delta(request, base_version, [("created", fspath.join(path, name), None)])
 
     def _rename(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, path = self.delegate(request)
         payload = request.get_json()
-        self.__move(
-            fs, payload.get("item", ""), fspath.join(path, payload.get("name", ""))
-        )
-        return self._index(request)
+        src = self._fs_path(payload.get("item", ""))
+        dst = fspath.join(path, payload.get("name", ""))
+        self.__move(fs, src, dst)
+        return self._delta(request, base_version, [("moved", src, dst)])
 
     def __move(self, fs, src, dst):
-        src = self._fs_path(src)
-        dst = self._fs_path(dst)
+        # validatepath 拒绝 .. 跳出根目录的路径, getsyspath 本身不做检查
+        src = fs.validatepath(self._fs_path(src))
+        dst = fs.validatepath(self._fs_path(dst))
+        if isinstance(fs, OSFS) and fs.exists(src) and not fs.exists(dst):
+            # OSFS 上直接 rename, 避免 movedir 退化成逐个复制再删除
+            try:
+                os.rename(fs.getsyspath(src), fs.getsyspath(dst))
+                return
+            except OSError:
+                pass
         if fs.isdir(src):
             fs.movedir(src, dst, create=True)
         else:
             fs.move(src, dst)
 
     def _move(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, _ = self.delegate(request)
         payload = request.get_json()
         dst_dir = payload.get("item", "")
+        changes = []
         for item in payload.get("items", []):
             src = item["path"]
-            self.__move(fs, src, fspath.combine(dst_dir, fspath.basename(src)))
-        return self._index(request)
+            dst = fspath.combine(dst_dir, fspath.basename(src))
+            self.__move(fs, src, dst)
+            changes.append(("moved", self._fs_path(src), self._fs_path(dst)))
+        return self._delta(request, base_version, changes)
 
     def _delete(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, path = self.delegate(request)
         payload = request.get_json()
+        changes = []
         for item in payload.get("items", []):
             path = self._fs_path(item["path"])
             if fs.isdir(path):
                 fs.removetree(path)
             else:
                 fs.remove(path)
+            changes.append(("deleted", path, None))
 
-        return self._index(request)
+        return self._delta(request, base_version, changes)
 
     def _upload(self, request: Request) -> Response:
         fs, path = self.delegate(request)
@@ -248,6 +349,7 @@ class VuefinderApp(object):
         return name
 
     def _archive(self, request: Request) -> Response:
+        base_version = self._version(request)
         payload = request.get_json()
         name = self._get_filename(payload, ext=".zip")
 
@@ -263,7 +365,7 @@ class VuefinderApp(object):
             with ZipFS(f, write=True) as zip:
                 self._write_zip(zip, fs, paths, path)
 
-        return self._index(request)
+        return self._delta(request, base_version, [("created", archive_path, None)])
 
     def _download_archive(self, request: Request):
         name = self._get_filename(request.args, ext=".zip")
@@ -288,6 +390,7 @@ class VuefinderApp(object):
         )
 
     def _unarchive(self, request: Request) -> Response:
+        base_version = self._version(request)
         fs, path = self.delegate(request)
         archive_path = self._fs_path(request.get_json().get("item"))
 
@@ -303,8 +406,11 @@ class VuefinderApp(object):
                         )
 
                 copy.copy_dir(zip, "/", fs, path)
+                changes = [
+                    ("created", fspath.join(path, name), None) for name in zip.listdir("/")
+                ]
 
-        return self._index(request)
+        return self._delta(request, base_version, changes)
 
     def _save(self, request: Request) -> Response:
         fs, path = self.delegate(request)
@@ -331,13 +437,16 @@ class VuefinderApp(object):
             raise BadRequest()
 
         response = None
-        try:
-            response = self.endpoints[endpoint](request)
-        except errors.ResourceReadOnly as exc:
-            response = json_response({"message": str(exc), "status": False}, 400)
-        except BadRequest as exc:
-            response = json_response({"message": exc.description, "status": False}, 400)
-
+        with trace_request(endpoint, self.slow_request_seconds) as trace:
+            try:
+                with span("handler"):
+                    response = self.endpoints[endpoint](request)
+            except (errors.ResourceReadOnly, errors.IllegalBackReference) as exc:
+                response = json_response({"message": str(exc), "status": False}, 400)
+            except BadRequest as exc:
+                response = json_response({"message": exc.description, "status": False}, 400)
+
+        headers["Server-Timing"] = trace.server_timing()
         response.headers.extend(headers)
         return response
 
@@ -0,0 +1,52 @@
+import contextlib
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+
+class Trace(object):
+    # 一次请求的各阶段耗时, 同名阶段累加
+    def __init__(self, name: str):
+        self.name = name
+        self.spans: Counter[str] = Counter()
+        self.duration = 0.0
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items())
+
+
+@contextlib.contextmanager
+def span(name: str):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans[name] += time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def trace_request(name: str, slow_seconds: float):
+    trace = Trace(name)
+    token = _current.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - start
+        _current.reset(token)
+        if trace.duration >= slow_seconds:
+            logger.warning(
+                "slow request %s %.3fs %s",
+                name,
+                trace.duration,
+                " ".join(f"{k}={v:.3f}s" for k, v in trace.spans.items()),
+            )